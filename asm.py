@@ -20,12 +20,27 @@ Syntax
 
 	[label | .label]   mnemonic   [operand,[operand]...]   [; comment]
 
+Use from python
+
+	a = Assembler(listing = None)
+	a.assembleString(source)				-> errors, a.output object records, a.labels
+	a.assembleFile("test.asm")			-> errors, writes test.obj
+	Assembler(stats = True)					-> a.stats.summary() phase times & counters
+
 
 """
 
+import io
+import os
+import re
 import sys
-import srec
-import ihex
+import time
+import zlib
+import json
+import base64
+import hashlib
+import marshal
+import expr
 
 #
 #	Register list
@@ -37,13 +52,6 @@ registers = [
 	"t", "n"
 ]
 
-#
-#	Label values dictionary simple name/value pairs
-#	Updated as defined, kept between passes
-#
-labels = {
-}
-
 LABEL_SCOPE = "."									# scope label for . locals
 
 #
@@ -61,7 +69,10 @@ INS_OPCODE_NONE				= -1				# no opcode or operands
 INS_OPCODE_OPS				= -2				# only operands
 INS_OPCODE_MC					= -3				# one address per operand
 
-instructions = {
+#
+#	Each assembler's instruction table starts as a copy of the internal directives
+#
+DIRECTIVES = {
 	#
 	#	Internal directives
 	#
@@ -103,17 +114,57 @@ instructions = {
 }
 
 #
-#	Source line list structure & indexes
+#	Instruction sets imported by isa, loaded once per process while the .obj is unchanged
+#		absolute .obj name -> [(size, mtime), content hash, {instruction: [opcode, operand bytes]}]
+#	Dropped when this process writes the .obj, see ObjWriter.close
+#
+isaTables = {
+}
+
+#
+#	Source line record
 #
-LINE_NUMBER		=	0
-LINE_LABEL 		= 1
-LINE_INSTR 		= 2
-LINE_OPERS		= 3										# list of operands
+class Line:
+
+	__slots__ = (
+		"number",																			# source fields
+		"label",
+		"instr",																			# mnemonic as written
+		"key",																				# interned instruction lookup key
+		"opers",																			# operands, tuple as parsed then list as resolved
+		"texts",																			# operands as parsed
+
+		"address",																		# assembled fields
+		"ins",																				# this line's instruction record
+		"bytes"																				# list of bytes representing this line
+	)
+
+	def __init__(self, label, instr, key, opers):
+		self.number = 0
+		self.label = label
+		self.instr = instr
+		self.key = key
+		self.opers = opers
+		self.texts = opers
+
+		self.address = 0
+		self.ins = None
+		self.bytes = []
 
-LINE_ADDRESS 				= 4
-LINE_INS						= 5							# copy of this line's instruction record
-LINE_BYTES 					= 6							# list of bytes representing this line
 
+#
+#	One scan of a source line:  [label]  [instruction  [operands]]  [; comment]
+#
+LEX_LINE	= re.compile(r"([^\s;]*)[ \t]*([^;]*)")
+LEX_INSTR	= re.compile(r"(\S*)\s*(.*?)\s*$", re.S)
+
+#
+#	Parsed statements by source text, the same instruction & operands repeat a lot
+#		(instr, key, (operands))
+#
+statements = {
+}
+STATEMENTS_MAX = 0x10000
 
 
 #
@@ -141,218 +192,265 @@ def expandStrings(s):
 
 
 #
-#	Parse one line of source to split out component fields
+#	Split an instruction and its operands, key and cache the result
 #
-def parseLine(source):
-	label = ""
-	instr = ""
-	opers = []
-
-	source = source.rstrip(" \t\n")									# discard carriage control
-	source = expandStrings(source)									# convert quoted strings to lists of chars
-	source = source.partition(";")[0]								# discard comments
-	source = source.replace("\t", " ")							# remove tabs to simplify later finds
-
-	#	First word on the line is a label
-	#
-	i = source.find(" ")														# ? label - word at the beginning of the line
-	if i == -1: i = len(source)
-	if i>0:
-		label = source[0:i]
-
-		if label[0].startswith("."):									# ? .local label
-			label = labels[LABEL_SCOPE] + "_" + label[1:]
-		else:																					# else normal label
-			labels[LABEL_SCOPE] = label									# save for the next local definition
+def parseStatement(stmt):
 
-	#	Second word is an instruction
-	#
-	source = source[i:].strip()											# remove leading whitespace
-	j = source.find(" ")
-	if j == -1: j = len(source)
-	instr = source[:j]
+	instr, opers = LEX_INSTR.match(stmt).groups()
 
-	# Third onwards are operands
-	#
-	source = source[j:].strip()
-	if source == "":
-		opers = []
+	if opers == "":
+		opers = ()
 	else:
-		opers = source.split(",")											# separate operands, leaves [''] if given an empty string
-		opers = [o.strip() for o in opers]
+		opers = tuple([o.strip() for o in opers.split(",")])
 
-	# Create the line structure
-	line = [
-		0,																						# source fields
-		label,
-		instr,
-		opers,
+	if len(statements) >= STATEMENTS_MAX:						# ? bound the cache on huge sources
+		statements.clear()
 
-		0,																						# assembled fields
-		[0, 0, 0],
-		[]
-	]
+	s = statements[stmt] = (instr, instrKey(instr, opers), opers)
 
-	return line
+	return s
 
 
 #
-#	Execute internal directives
+#	Create a unique instruction key from its mnemonic & operand types
 #
-def runDirectives(line):
+def instrKey(instr, opers):
 
-	label		= line[LINE_LABEL]
-	inst 		= line[LINE_INSTR]
-	try:		op0 = line[LINE_OPERS][0]
-	except: op0 = ""
+	if instr == "":																	# no instruction
+		return ""
 
-	if inst == "org":																# org address
-		op0 = max(0, op0)
-		labels["*"] = op0
-		line[LINE_ADDRESS] = labels["*"]
+	key = instr + "."
+	for o in opers:
+		o0 = o[:1]
 
-	elif inst == "isa":															# instruction set architecture, import file
-		op0 = op0.partition(".")[0] + ".obj"
-		importInstructions(op0)
+		if o in registers				: key += o
+		if o0 == "#"						:	key += "#"
+		if o0 == "("						: key += "("
 
-	elif inst == "ds.b" or inst == "bytes":					# reserve uninitialised bytes
-		labels["*"] += max(0, op0)
+	return sys.intern(key.strip("."))
 
-	elif inst == "ds.w" or inst == "words":					# reserve uninitialised words
-		labels["*"] += max(0, op0) *2
 
-	elif inst == "align":														# align <byte multiplier>
-		op0 = max(1, op0)
-		labels["*"] = -labels["*"] // op0 * -op0			# -ve // modulus to ceiling the divided number
-		line[LINE_ADDRESS] = labels["*"]
+#
+#	Assembler
+#
+#	Owns its label & instruction tables and output, so any number can be used in one process.
+#		listing		stream for the listing & diagnostics, None for none
+#		passes		1 patches forward references at end of file, 2 reads the source twice
+#		cache			read & update the build cache, assembleFile only
+#		binary		also write the .bin memory image and .sym symbol table
+#		reloc			write a relocatable .rel module for the linker instead of the .obj, one pass only
+#		stats			time each phase & count calls, pending operands and output, see Stats
+#
+class Assembler:
+
+	expandStrings = staticmethod(expandStrings)			# per instance when instrumented
+
+	def __init__(self, listing = sys.stdout, passes = 1, cache = False, binary = False, reloc = False,
+							stats = False):
+		self.listing = listing
+		self.passes = 1 if reloc else passes
+		self.cache = cache
+		self.binary = binary and not reloc
+		self.reloc = reloc
+
+		self.labels = {}															# label values, simple name/value pairs
+		self.instructions = dict(DIRECTIVES)
+		self.depends = {}															# file name -> content hash, files read by the source
+		self.relocs = set()														# labels relative to the module start, reloc only
+		self.output = None														# ObjWriter of the last assembly
+		self.errors = 0
+		self.stats = Stats(self) if stats else None		# None costs nothing when off
+
+	#
+	#	Listing & diagnostic output
+	#
+	def log(self, *args):
 
-	elif inst == "mch":															# microcode header: align, oper size
-		op0 = max(1, op0)
-		labels["*"] = -labels["*"] // op0 * -op0			# -ve // modulus to ceiling the divided number
-		line[LINE_ADDRESS] = labels["*"]
-		if label:
-			labels[label +".instr"] = labels["*"] >> 3				# labels used to populate the instructions table
-			labels[label +".obytes"] = line[LINE_OPERS][1]		# operands total bytes
+		if self.listing is not None:
+			print(*args, file = self.listing)
 
-	#	labels are either the line address or an explicit = declaration
 	#
-	if inst == "=":																	# ? label = value declaration
-		labels[label] = op0
-	elif label != "":																# default to the line address
-		labels[label] = line[LINE_ADDRESS]
+	#	Clear everything from a previous assembly
+	#
+	def reset(self):
 
-	return
+		self.labels.clear()
+		self.depends.clear()
+		self.relocs.clear()
+		self.instructions = dict(DIRECTIVES)
+		self.output = None
+		self.errors = 0
 
+	#
+	#	Assemble a source file in one or two passes, writing its .obj
+	#	Unchanged sources assembled against unchanged dependencies are written from the build cache
+	#
+	def assembleFile(self, name):
+
+		self.reset()
+		base = name.partition(".")[0]
+		src = base + ".asm"															# force .asm suffix
+		obj = base + (OUT_REL if self.reloc else OUT_OBJ)
+
+		if self.cache and self.cacheLoad(src, base):
+			if self.stats: self.stats.count("cacheHits")
+			self.log("{} unchanged, {} written from the build cache".format(src, obj))
+			self.listLabels()
+			return 0																			# ------>
+
+		if self.passes == 2:
+			for p in (1, 2):															# pass 1, pass 2 re-reads the source
+				with open(src) as f:
+					self.asmPass(f, p, obj)
+		else:
+			with open(src) as f:
+				self.asmOnePass(f, obj)
 
-#
-#	Create a unique instruction key from its mnemonic & operand types
-#
-def instrKey(line):
+		if self.cache and self.errors == 0:
+			self.cacheSave(src, base)
 
-	if line[LINE_INSTR] == "":																		# no instruction
-		return
+		self.listLabels()
 
-	key = line[LINE_INSTR] + "."
-	for o in line[LINE_OPERS]:
-		o0 = str(o)[0]
+		return self.errors
 
-		if o in registers				: key += o
-		if key == "mc"					:	key += "mc"
-		if o0 == "#"						:	key += "#"
-		if o0 == "("						: key += "("
+	#
+	#	Assemble source lines from a stream, obj names the object file to write if any
+	#
+	def assembleStream(self, f, obj = None):
 
-	line[LINE_INSTR] = key.strip(".")
+		self.reset()
 
-	return
+		if self.passes == 2:
+			lines = list(f)
+			self.asmPass(lines, 1, obj)
+			self.asmPass(lines, 2, obj)
+		else:
+			self.asmOnePass(f, obj)
 
+		self.listLabels()
 
-#
-#	Format operators for python eval
-# 	()#$ to 0x 0b
-#		. - to _					Eval interprets . as method call, - as operator
-#
-def formatOper(o):
+		return self.errors
 
-	o = o.replace("#","").replace("(","").replace(")","")
-	o = o.replace("$","0x").replace("%","0b")
-	o = o.replace(".","_").replace("-","_")
+	def assembleString(self, source, obj = None):
 
-	return o
+		return self.assembleStream(io.StringIO(source), obj)
 
+	#
+	#	Parse one line of source to split out component fields
+	#
+	def parseLine(self, source):
 
-#
-#	Numbers formatted, local labels formatted, registers & references resolved
-#
-def resolveOpers(line):
+		if "\"" in source or "'" in source:						# convert quoted strings to lists of chars
+			source = self.expandStrings(source.rstrip(" \t\r\n"))
 
-	for i in range(0, len(line[LINE_OPERS])):
-		o = line[LINE_OPERS][i]
+		label, stmt = LEX_LINE.match(source).groups()
 
-		if o in registers:														# ? registers
-			o = ""																			# ignored
+		#	First word on the line is a label
+		#
+		if label:
+			if label[0] == ".":													# ? .local label
+				label = self.labels[LABEL_SCOPE] + "_" + label[1:]
+			else:																				# else normal label
+				self.labels[LABEL_SCOPE] = label					# save for the next local definition
 
-		elif o.startswith("."):												# ? local
-			o = labels[LABEL_SCOPE] + "_" + o[1:]				# .prefix with last label to localise
+		#	Instruction & operands
+		#
+		s = statements.get(stmt)
+		if s is None:
+			s = parseStatement(stmt)
 
-		if o != "":
-			try:																				# lookup labels, evaluate  << >> && etc
-				o = eval(formatOper(o), {}, labels)
-			except Exception as err:										# will fail in pass 1 on forward references
-				pass
+		return Line(label, s[0], s[1], s[2])
 
-		line[LINE_OPERS][i] = o
-																									# remove empty strings
-	line[LINE_OPERS] = [o for o in line[LINE_OPERS] if o != ""]
+	#
+	#	Execute internal directives
+	#
+	def runDirectives(self, line):
+
+		labels	= self.labels
+		label		= line.label
+		inst 		= line.key
+		try:		op0 = line.opers[0]
+		except: op0 = ""
+
+		if inst == "org":															# org address
+			op0 = max(0, op0)
+			labels["*"] = op0
+			line.address = labels["*"]
+
+		elif inst == "isa":														# instruction set architecture, import file
+			op0 = op0.partition(".")[0] + ".obj"
+			self.importInstructions(op0)
+
+		elif inst == "ds.b" or inst == "bytes":				# reserve uninitialised bytes
+			labels["*"] += max(0, op0)
+
+		elif inst == "ds.w" or inst == "words":				# reserve uninitialised words
+			labels["*"] += max(0, op0) *2
+
+		elif inst == "align":													# align <byte multiplier>
+			op0 = max(1, op0)
+			labels["*"] = -labels["*"] // op0 * -op0		# -ve // modulus to ceiling the divided number
+			line.address = labels["*"]
+
+		elif inst == "mch":														# microcode header: align, oper size
+			op0 = max(1, op0)
+			labels["*"] = -labels["*"] // op0 * -op0		# -ve // modulus to ceiling the divided number
+			line.address = labels["*"]
+			if label:
+				labels[label +".instr"] = labels["*"] >> 3			# labels used to populate the instructions table
+				labels[label +".obytes"] = line.opers[1]				# operands total bytes
+
+		#	labels are either the line address or an explicit = declaration
+		#
+		if inst == "=":																# ? label = value declaration
+			labels[label] = op0
+			if self.reloc and line.texts and isinstance(op0, int):
+				self.declareRelative(label, line.texts[0], labels[LABEL_SCOPE], line.number)
+		elif label != "":															# default to the line address
+			labels[label] = line.address
+			if self.reloc:															# addresses move with the module
+				self.relocs.add(label)
 
-	return
+		return
 
+	#
+	#	Numbers formatted, local labels formatted, registers & references resolved
+	#	Forward references are left as their source text until defined
+	#
+	def resolveOpers(self, line):
 
-#
-#	Process passed input source file
-#
-#	Pass 1 - resolve label addresses
-# Pass 2 - generate assembly and listing
-#
-def asmFile(name, p):
+		labels = self.labels
+		scope = labels[LABEL_SCOPE]
+		opers = []
+		for o in line.opers:
+			if o in registers or o == "":								# ? registers, ignored
+				continue																	# <-------
 
-	errors = 0
-	ln = 0																					# line number
-	labels["*"] = 0																	# assembly address
-	labels[LABEL_SCOPE] = ""												# label used to expand locals
-	fout = 0																				# output object file, only on pass 2
+			v = expr.evalOper(o, labels, scope)					# lookup labels, evaluate  << >> && etc
+			if v is expr.PENDING:												# will be pending in pass 1 on forward references
+				v = o
+				if self.stats: self.stats.count("pending")
+			opers.append(v)
 
-	# If pass 2 open the output object file
-	#
-	if p == 2:
-		fOut = open(name.partition(".")[0] + ".obj", "w")
+		line.opers = opers
 
+		return
 
-	#	Read the input file line by line and parse into components
 	#
-	name = name.partition(".")[0] + ".asm"					# force .asm suffix
-	f = open(name)
-	for source in f:
+	#	Parse one source line, resolve operands, run directives & advance the assembly address
+	#
+	def asmLine(self, source, ln):
 
-		line = parseLine(source)											# parse
+		labels = self.labels
+		line = self.parseLine(source)									# parse
 
-		ln += 1																				# line number
-		line[LINE_NUMBER] = ln
-		line[LINE_ADDRESS] = labels["*"]
+		line.number = ln
+		line.address = labels["*"]
 
-		instrKey(line)																# generate instruction lookup key
-		resolveOpers(line)														# operand lookup
-		runDirectives(line)														# internal assembler directives & assignments
+		self.resolveOpers(line)												# operand lookup
+		self.runDirectives(line)											# internal assembler directives & assignments
 
-		# Lookup the instruction details
-		#
-		i = line[LINE_INSTR]
-		if i in instructions:
-			ins = instructions[i]
-		else:
-			errors += 1
-			print("Unknown instruction: '{}' on line {}".format(i, ln))
-			ins = instructions[""]											# process as null instruction
-		line[LINE_INS] = ins													# take a copy into the line for reference
+		ins = line.ins = self.lookupInstruction(line)	# take a copy into the line for reference
 
 		# Increment address pointer for instruction and operands depending on type
 		#
@@ -361,171 +459,1016 @@ def asmFile(name, p):
 			labels["*"] += 1
 
 		if op >= 0 or op == -2:												# ? opcode or directive with operands to assemble
-			labels["*"] += ins[INS_OPER_BYTES] * len(line[LINE_OPERS])
+			labels["*"] += ins[INS_OPER_BYTES] * len(line.opers)
 
 		if op == -3:																	# ? one address per operand, wide words for MC etc
-			labels["*"] += len(line[LINE_OPERS])
+			labels["*"] += len(line.opers)
+
+		return line
+
+	#
+	#	Lookup the instruction details
+	#
+	def lookupInstruction(self, line):
+
+		ins = self.instructions.get(line.key)
+		if ins is None:
+			self.errors += 1
+			self.log("Unknown instruction: '{}' on line {}".format(line.key, line.number))
+			ins = self.instructions[""]									# process as null instruction
+
+		return ins
+
+	#
+	#	Process source lines
+	#
+	#	Pass 1 - resolve label addresses
+	# Pass 2 - generate assembly and listing
+	#
+	def asmPass(self, source, p, obj = None):
 
+		self.errors = 0
+		ln = 0																				# line number
+		self.labels["*"] = 0													# assembly address
+		self.labels[LABEL_SCOPE] = ""									# label used to expand locals
+
+		# If pass 2 open the output object file
+		#
+		if p == 2:
+			fOut = self.output = ObjWriter(obj, self.binary)
 
-		#	Pass 1 ends - Forward references will not be resolved yet
+		#	Read the input line by line and parse into components
 		#
-		if p == 1:																		# ? pass 1
-			continue																		# <-----------
+		for s in source:
 
+			ln += 1																			# line number
+			line = self.asmLine(s, ln)
 
-		#	Pass 2 - Assemble machine code
+			#	Pass 1 ends - Forward references will not be resolved yet
+			#
+			if p == 1:																	# ? pass 1
+				continue																	# <-----------
+
+			#	Pass 2 - Assemble machine code
+			#
+			self.assembleLine(line, fOut)
+			self.listLine(line)
+
+		#	Tidy up
 		#
-		assembleLine(line, fOut)
-		listLine(line)
+		if p == 2:
+			self.writeLabels(fOut)
+			self.closeOutput(fOut)
+
+		self.log("\nPass {}: {} errors found".format(p, self.errors))
+
+		return
+
+	#
+	#	Process source lines in one pass
+	#
+	#	Each line is assembled & written to the object file as it is read, operands
+	#	referring to labels not yet defined assemble as 0 and are recorded as fixups, by
+	#	their offset in the output run, then patched in one sweep at the end of file.
+	#	The object file & listing match the two pass output.  From the first line with a
+	#	fixup the listing is held, that line as its record & the rest as text, and printed
+	#	with the patched bytes after the sweep.
+	#
+	def asmOnePass(self, source, obj = None):
+
+		labels = self.labels
+		self.errors = 0
+		ln = 0																				# line number
+		labels["*"] = 0																# assembly address
+		labels[LABEL_SCOPE] = ""											# label used to expand locals
+
+		fOut = self.output = ObjWriter(obj, self.binary)
+		fixups = []																		# [operand, scope, line number, run, offset, width, line, index]
+		held = []																			# listing text or [line, run, offset] from the first fixup
+		listing = self.listing is not None
+		symbols = []																	# [label, operand, scope, line number]	label = forward reference
+		fields = []																		# [line number, scope, field address, width, operands, run, offset]
+
+		#	Read the input line by line, assemble & write what is known
+		#
+		for s in source:
+
+			ln += 1																			# line number
+			line = self.asmLine(s, ln)
+
+			if line.key == "isa":												# file name operand, never resolves
+				self.listHeld(held, line)
+				continue																	# <-----------
+
+			ins = line.ins
+			op = ins[INS_OPCODE]
+			opers = line.opers
+			pending = [(i, o) for i, o in enumerate(opers) if isinstance(o, str)]
+			for i, o in pending:													# ? forward reference, 0 until patched
+				opers[i] = 0
+
+			out = self.assembleLine(line, fOut)					# (run, offset) of its bytes or None
+			run, start = out if out else (None, 0)
+			width = ins[INS_OPER_BYTES]
+			offset = start + 1 if op >= 0 else start			# after the opcode
+
+			scope = labels[LABEL_SCOPE]
+			for i, o in pending:
+				opers[i] = o
+				fixups.append([o, scope, ln, run, offset + i * width, width, line if listing else None, i])
+				if line.key == "=":
+					symbols.append([line.label, o, scope, ln])
+
+			if self.reloc and opers and (op >= 0 or op == -2):
+				fields.append([ln, scope, line.address + (1 if op >= 0 else 0), width,
+					[o for o in line.texts if o not in registers and o != ""], run, offset])
+
+			if pending and listing:
+				held.append([line, run, start])						# listed once patched
+			else:
+				self.listHeld(held, line)
+
+		#	Patch forward references, label declarations first
+		#
+		if self.stats:
+			self.stats.count("fixups", len(fixups))
+			self.stats.count("symbolFixups", len(symbols))
+
+		while symbols:																# until a sweep resolves nothing, eg. a = b, b = c
+			left = []
+			for symbol in symbols:
+				label, o, scope, ln = symbol
+				v = expr.evalOper(o, labels, scope)
+				if v is expr.PENDING:
+					left.append(symbol)
+					continue																# <-------
+				labels[label] = v
+				if self.reloc:
+					self.declareRelative(label, o, scope, ln)
+			if len(left) == len(symbols):
+				break																			# --->
+			symbols = left
+
+		for o, scope, ln, run, offset, width, line, i in fixups:
+			v = expr.evalOper(o, labels, scope)
+			if v is expr.PENDING:
+				if self.reloc and run is not None:					# ? import, resolved by the linker
+					continue																# <-------
+				self.errors += 1
+				self.log("Undefined symbol: '{}' on line {}".format(o, ln))
+				v = 0
+			if run is not None:
+				patch(run, offset, width, v)
+			if line is not None:
+				line.opers[i] = v
+
+		if self.reloc:
+			for field in fields:
+				self.relocateLine(field, fOut)
+
+		for h in held:																# listing from the first fixup
+			if isinstance(h, str):
+				self.log(h)
+				continue																	# <-------
+			line, run, start = h
+			if run is not None:
+				line.bytes = list(run[start:start + len(line.bytes)])
+			self.listLine(line)
+
+		self.writeLabels(fOut)
+		self.closeOutput(fOut)
+
+		self.log("\nOne pass: {} errors found".format(self.errors))
+
+		return
+
+	#
+	#	Relocatable module fields of one line, patched in its output run
+	#		[line number, scope, field address, width, operand texts, run, offset]
+	#
+	#	Operands referring to module labels get a relocation record, the linker adds the
+	#	module base.  Operands referring to one undefined symbol get an import record, with
+	#	the rest of the expression assembled into the field as the addend.  Either must be
+	#	a label plus a constant, anything else is an error rather than mis-linked.
+	#
+	def relocateLine(self, field, oFile):
+
+		labels = self.labels
+		ln, scope, addr, width, texts, run, offset = field
+
+		for o in texts:
+			names = expr.operNames(o, scope)
+			undefined = [n for n in names if type(labels.get(n)) is not int]
+			relative = [n for n in names if n in self.relocs]
+
+			if len(undefined) > 1:												# ? can't import more than one
+				self.errors += 1
+				self.log("Undefined symbols: '{}' on line {}".format(o, ln))
+				patch(run, offset, width, 0)
+
+			elif undefined and relative:									# ? import & module base both
+				self.notRelocatable(o, ln)
+				patch(run, offset, width, 0)
+
+			elif undefined:
+				labels[undefined[0]] = 0										# addend, value with the symbol at 0
+				v = expr.evalOper(o, labels, scope)
+				moves = self.moves(o, scope, undefined)
+				del labels[undefined[0]]
+				if moves:
+					patch(run, offset, width, v)
+					oFile.imports.append([addr, width, undefined[0]])
+				else:
+					self.notRelocatable(o, ln)
+					patch(run, offset, width, 0)
+
+			elif relative:
+				if self.moves(o, scope, relative):
+					oFile.relocs.append([addr, width])
+				else:
+					self.notRelocatable(o, ln)
+
+			addr += width
+			offset += width
+
+		return
+
+	#
+	#	True if an operand's value moves by exactly as much as the named labels, moved
+	#	together by several offsets, ie. label + constant, all a linker can relocate
+	#
+	def moves(self, o, scope, names):
+
+		labels = self.labels
+		saved = [labels[n] for n in names]
+		v = expr.evalOper(o, labels, scope)
+
+		ok = v is not expr.PENDING
+		for d in RELOC_SHIFTS:
+			if not ok:
+				break																			# --->
+			for n, x in zip(names, saved):
+				labels[n] = x + d
+			ok = expr.evalOper(o, labels, scope) == v + d
 
+		for n, x in zip(names, saved):
+			labels[n] = x
 
-	#	Tidy up
+		return ok
+
+	def notRelocatable(self, o, ln):
+
+		self.errors += 1
+		self.log("Not relocatable, only label + constant: '{}' on line {}".format(o, ln))
+
+	#
+	#	A label declared as an operand, module relative if the operand moves with the module
+	#
+	def declareRelative(self, label, o, scope, ln):
+
+		names = [n for n in expr.operNames(o, scope) if n in self.relocs]
+		if not names:
+			return																			# ------>
+
+		if self.moves(o, scope, names):
+			self.relocs.add(label)
+		else:
+			self.notRelocatable(o, ln)
+
+		return
+
+	#
+	#	Write the output files, reporting anything that wouldn't fit
 	#
-	f.close()
-	if p == 2:
-		writeLabels(fOut)
+	def closeOutput(self, fOut):
+
 		fOut.close()
+		if self.stats: self.stats.output(fOut)
+		for addr, size in fOut.outside:
+			self.log("${:x} outside the {} byte image".format(addr, size))
 
-	print("\nPass {}: {} errors found".format(p, errors))
+		return
 
-	return
+	#
+	#	Generate the lines byte array & output to its object file
+	#	Returns (run, offset) where its bytes were written, None if it has none
+	#
+	def assembleLine(self, line, oFile):
+
+		opers = line.opers
+		bytes = line.bytes
+
+		ins = line.ins
+		op = ins[INS_OPCODE]
+		operBytes = ins[INS_OPER_BYTES]
+
+		if op >= 0:
+			bytes.append(op)													# opcode
+
+		if op >= 0 or op == -2 or op == -3:
+			for i in range(len(opers)):								# little endian byte list
+				op = opers[i]
+				if operBytes >= 1:											# $xxxxxxff
+					bytes.append(op & 0xff)
+				if operBytes >= 2:											# $xxxxffxx
+					op >>= 8
+					bytes.append(op & 0xff)
+				if operBytes >= 4:											# $ffffxxxx
+					op >>= 8
+					bytes.append(op & 0xff)
+					op >>= 8
+					bytes.append(op & 0xff)
+
+		if len(line.bytes):													# if there are any bytes -> object file
+			if ins[INS_OPCODE] == -3:
+				return oFile.data(line.address, bytes, operBytes)	# one address per operand
+			return oFile.data(line.address, bytes)			# ------>
+
+		return None
+
+	#
+	#	List a line, or hold its text once the one pass listing is being held
+	#
+	def listHeld(self, held, line):
+
+		if self.listing is None:
+			return																			# ------>
+
+		if held:
+			held.append(self.listText(line))
+		else:
+			self.listLine(line)
+
+		return
+
+	#	Generate line listing
+	#
+	def listLine(self, line):
+
+		if self.listing is None:
+			return																			# ------>
+
+		self.log(self.listText(line))
+
+		return
+
+	def listText(self, line):
+
+		opers = line.opers
+		bytes = line.bytes
+		operBytes = line.ins[INS_OPER_BYTES]
+
+		outo = ""																		# format operands
+		for oper in opers:
+			of = oper																	# posit register name string
+			if isinstance(oper, int):									# ? number
+				if	 operBytes == 1: of = "${:02x}".format(oper)
+				elif operBytes == 2: of = "${:04x}".format(oper)
+				else:								 of = "${:08x}".format(oper)
+			outo += ", " + of
+
+		outb = ""																		# format byte list
+		for b in bytes:
+			outb += "{:02x} ".format(b)
+
+		#	Assembly listing
+		#
+		return "{:4} {:04x} {:20} {:16} {:10} {}".format(
+			line.number,
+			line.address,
+			outb[:20],
+			line.label,
+			line.key,
+			outo[1:])
+
+	#
+	# label dictionary output cross reference in alphabetical order
+	#
+	def listLabels(self):
+
+		if self.listing is None:
+			return																			# ------>
+
+		self.log()
+		for l, v in sorted(self.labels.items()):
+			if isinstance(v, int):
+				v="${:04X}".format(v)
+			self.log("{:20} = {:>10}".format(l, v))
+
+		return
+
+	#
+	#	label dictionary output in object file format
+	#
+	def writeLabels(self, oFile):
+
+		for l, v in self.labels.items():
+			if isinstance(v, int):
+				oFile.label(v, l, l in self.relocs)
+
+		return
+
+	#
+	#	Add an instruction set to the instruction table
+	#	Tables already loaded by this process, or passed to its workers, are reused while
+	#	the .obj has the same size & mtime
+	#
+	def importInstructions(self, name):
+
+		isa = isaTable(name)
+		if isa is None:
+			self.log("\n{} instructions file not found".format(name))
+			return																			# ------>
+
+		self.depends[os.path.abspath(name)] = isa[0]		# assembly depends on its content
+		self.instructions.update(isa[1])
+
+		self.log("\n{} instructions loaded from {}".format(len(isa[1]), name))
 
+		return
+
+	#
+	#	Write the output files & restore labels from a valid cache entry
+	#	Returns True on a hit
+	#
+	def cacheLoad(self, src, base):
+
+		try:
+			with open(cacheName(src)) as f:
+				entry = json.load(f)
+		except (OSError, ValueError):
+			return False																# ------>
+
+		if entry["source"] != fileHash(src) or entry["tool"] != toolHash():
+			return False																# ------>
+
+		for d, h in entry["depends"].items():					# ? isa object files changed
+			isa = loadInstructions(d)
+			if isa is None or isa[0] != h:
+				return False															# ------>
+
+		outputs = entry["outputs"]
+		wanted = [OUT_REL if self.reloc else OUT_OBJ] + ([OUT_BIN, OUT_SYM] if self.binary else [])
+		if any(suffix not in outputs for suffix in wanted):	# ? not built last time, eg. no -b
+			return False																# ------>
+
+		for suffix in wanted:													# only what this run writes
+			text = outputs[suffix]
+			if suffix == OUT_BIN:
+				replaceFile(base + suffix, zlib.decompress(base64.b64decode(text)))
+			else:
+				replaceFile(base + suffix, text)
+
+		self.labels.update(entry["labels"])
+		self.depends.update(entry["depends"])
+
+		return True
+
+	#
+	#	Store a successful assembly with the output files it wrote
+	#
+	def cacheSave(self, src, base):
+
+		outputs = {}
+		for name in self.output.files:
+			suffix = name[len(base):]
+			if suffix == OUT_BIN:
+				with open(name, "rb") as f:
+					outputs[suffix] = base64.b64encode(zlib.compress(f.read())).decode()
+			else:
+				with open(name) as f:
+					outputs[suffix] = f.read()
+
+		entry = {
+			"source":		fileHash(src),
+			"tool":			toolHash(),
+			"depends":	self.depends,
+			"labels":		self.labels,
+			"outputs":	outputs
+		}
+
+		os.makedirs(CACHE_DIR, exist_ok = True)
+		name = cacheName(src)
+		with open(name + ".tmp", "w") as f:						# replace whole, no partial entries
+			json.dump(entry, f)
+		os.replace(name + ".tmp", name)
+
+		return
+
+
+#
+#	Assembler instrumentation, --stats
+#
+#	Wraps the phase methods of one Assembler instance with timers, the class and any
+#	other instance are untouched so the cost with stats off is a None test on rare paths.
+#	Times are wall clock & inclusive, eg. assembleFile includes every other phase.
 #
-#	Generate the lines byte array & output to its object file
+#	Counters
+#		pending				operands unresolved when first evaluated, forward references
+#		fixups				operands patched at the end of a one pass assembly
+#		symbolFixups	label declarations patched at the end of a one pass assembly
+#		cacheHits			sources written from the build cache
+#		outputBytes		object data bytes, outputRecords records written, outputLabels
 #
-def assembleLine(line, oFile):
+class Stats:
 
-	opers = line[LINE_OPERS]
-	bytes = line[LINE_BYTES]
+	PHASES = (
+		"assembleFile", "asmPass", "asmOnePass",
+		"parseLine", "expandStrings", "resolveOpers", "runDirectives", "lookupInstruction",
+		"assembleLine", "relocateLine", "listLine", "listLabels", "writeLabels", "closeOutput",
+		"importInstructions", "cacheLoad", "cacheSave"
+	)
 
-	ins = line[LINE_INS]
-	op = ins[INS_OPCODE]
-	operBytes = ins[INS_OPER_BYTES]
+	def __init__(self, a = None):
+		self.calls = {}
+		self.seconds = {}
+		self.counters = {}
 
-	if op >= 0:
-		bytes.append(op)														# opcode
+		if a is not None:
+			for name in self.PHASES:
+				setattr(a, name, self.timed(name, getattr(a, name)))
 
-	if op >= 0 or op == -2 or op == -3:
-		for i in range(len(opers)):									# little endian byte list
-			op = opers[i]
-			if operBytes >= 1:												# $xxxxxxff
-				bytes.append(op & 0xff)
-			if operBytes >= 2:												# $xxxxffxx
-				op >>= 8
-				bytes.append(op & 0xff)
-			if operBytes >= 4:												# $ffffxxxx
-				op >>= 8
-				bytes.append(op & 0xff)
-				op >>= 8
-				bytes.append(op & 0xff)
+	#	Function calling fn, adding to its phase's calls & seconds
+	#
+	def timed(self, name, fn):
+		calls = self.calls
+		seconds = self.seconds
+		calls[name] = 0
+		seconds[name] = 0.0
+		clock = time.perf_counter
+
+		def phase(*args):
+			t = clock()
+			try:
+				return fn(*args)
+			finally:
+				seconds[name] += clock() - t
+				calls[name] += 1
+
+		return phase
+
+	def count(self, name, n = 1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def output(self, fOut):
+		self.count("outputBytes", sum(len(run) for start, unit, run in fOut.runs))
+		self.count("outputRecords", fOut.count)
+		self.count("outputLabels", len(fOut.labels))
+
+	#	Add a summary, eg. from another file or worker
+	#
+	def add(self, summary):
+		for name, p in summary["phases"].items():
+			self.calls[name] = self.calls.get(name, 0) + p["calls"]
+			self.seconds[name] = self.seconds.get(name, 0.0) + p["seconds"]
+		for name, n in summary["counters"].items():
+			self.count(name, n)
+
+	#	JSON ready summary, phases that ran in PHASES order
+	#
+	def summary(self):
+		return {
+			"phases":		{name: {"calls": self.calls[name], "seconds": round(self.seconds[name], 6)}
+										for name in self.PHASES if self.calls.get(name)},
+			"counters":	dict(self.counters)
+		}
 
-	if len(line[LINE_BYTES]):											# if there are any bytes -> object file
-		oFile.write(srec.srec(line[LINE_ADDRESS], bytes))
-		oFile.write("\n")
 
-	return
+#
+#	Build cache
+#
+#	One entry per source file in CACHE_DIR holding its final labels & output files.
+#	An entry is used when the hashes of the source, the assembler itself and every
+#	file read while assembling it (isa object files) are unchanged.
+#
+CACHE_DIR = ".asmcache"
+
+tools = []																				# hash of the assembler source, once
+
 
 #
-#	Generate line listing
+#	Hex digest of a file's content, "" if it can't be read
 #
-def listLine(line):
+def fileHash(name):
 
-	opers = line[LINE_OPERS]
-	bytes = line[LINE_BYTES]
-	operBytes = line[LINE_INS][INS_OPER_BYTES]
+	try:
+		with open(name, "rb") as f:
+			return hashlib.sha256(f.read()).hexdigest()
+	except OSError:
+		return ""
 
-	outo = ""																			# format operands
-	for oper in opers:
-		of = oper																		# posit register name string
-		if isinstance(oper, int):										# ? number
-			if	 operBytes == 1: of = "${:02x}".format(oper)
-			elif operBytes == 2: of = "${:04x}".format(oper)
-			else:								 of = "${:08x}".format(oper)
-		outo += ", " + of
 
-	outb = ""																			# format byte list
-	for b in bytes:
-		outb += "{:02x} ".format(b)
+#
+#	Hash of the assembler modules, changes to them invalidate every entry
+#
+def toolHash():
 
-	#	Assembly listing
-	#
-	print("{:4} {:04x} {:20} {:16} {:10} {}".format(
-		line[LINE_NUMBER],
-		line[LINE_ADDRESS],
-		outb[:20],
-		line[LINE_LABEL],
-		line[LINE_INSTR],
-		outo[1:])
-	)
+	if not tools:
+		h = hashlib.sha256()
+		here = os.path.dirname(os.path.abspath(__file__))
+		for m in ("asm.py", "expr.py", "srec.py", "ihex.py", "loader.py"):
+			with open(os.path.join(here, m), "rb") as f:
+				h.update(f.read())
+		tools.append(h.hexdigest())
+
+	return tools[0]
 
-	return
 
 #
-# label dictionary output cross reference in alphabetical order
+#	Cache entry file for a source
 #
-def listLabels():
+def cacheName(src):
+
+	path = os.path.abspath(src)
+	key = hashlib.sha256(path.encode()).hexdigest()[:16]
 
-	print()
-	for l, v in sorted(labels.items()):
-		if isinstance(v, int):
-			v="${:04X}".format(v)
-		print("{:20} = {:>10}".format(l, v))
+	return os.path.join(CACHE_DIR, "{}-{}.json".format(os.path.basename(src), key))
+
+
+#
+#	Offsets a relocatable operand is moved by to check it moves with its label
+#
+RELOC_SHIFTS = (1, 0xff, 0x1000)
+
+
+#
+#	Write a whole file through a temporary & rename, readers never see it part written
+#
+def replaceFile(name, data):
+
+	with open(name + ".tmp", "wb" if isinstance(data, (bytes, bytearray)) else "w") as f:
+		f.write(data)
+	os.replace(name + ".tmp", name)
 
 	return
 
+
 #
-#	label dictionary output in object file format
+#	Little endian value into width bytes of an output run at an offset
 #
-def writeLabels(oFile):
+def patch(run, offset, width, v):
 
-	for l, v in labels.items():
-		if isinstance(v, int):
-			oFile.write(srec.srecL(v, l))
-			oFile.write("\n")
+	for i in range(width):
+		run[offset + i] = v >> 8 * i & 0xff
 
 	return
 
+
 #
-#	read instruction information from microcode.obj labels
-#		label.instr			opcode
-#		label.obytes		bytes per operand
+#	Object file writer
+#
+#	Bytes are collected into contiguous address runs and written as full length
+#	S1/S3 records, followed by the S4/S6 label records, in one write at close.
+#	Runs have an address unit, bytes per address, mc words are 4 bytes per address.
+#	With no file name the records are only kept in memory.
+#
+#	binary also writes a flat memory image ready to mmap, with a symbol table alongside
+#		.bin		64K ram image, or packed little endian 32 bit words for mc microcode
+#		.sym		one "address label" line per label, address in hex
 #
+#	Relocatable modules add relocation & import records after the labels, see srec.py
 #
-def importInstructions(name):
+REC_BYTES = 248																		# data bytes per record, any address size
+
+OUT_OBJ = ".obj"
+OUT_REL = ".rel"
+OUT_BIN = ".bin"
+OUT_SYM = ".sym"
+
+RAM_BYTES	= 0x10000															# 64k x 8 bits
+MC_WORDS	= 2048																# 2k x 32 bits
+
+class ObjWriter:
+
+	def __init__(self, name = None, binary = False):
+		self.name = name
+		self.binary = binary
+		self.runs = []																# [start address, unit, bytearray]
+		self.labels = []															# [address, label, module relative]
+		self.relocs = []															# [field address, width]
+		self.imports = []															# [field address, width, symbol]
+		self.outside = []															# [address, image size] runs not in the image
+		self.files = []																# written by close
+		self.count = 0																# records written by text
+
+	#	Append bytes at an address, extending the last run if contiguous
+	#	Returns (run, offset) of the bytes in the run, for patching
+	#
+	def data(self, addr, bytes, unit = 1):
+		if self.runs:
+			start, u, run = self.runs[-1]
+			if u == unit and start + len(run) // unit == addr:
+				offset = len(run)
+				run.extend(bytes)
+				return run, offset												# ------>
+
+		run = bytearray(bytes)
+		self.runs.append([addr, unit, run])
+
+		return run, 0
+
+	def label(self, addr, name, relative = False):
+		self.labels.append([addr, name, relative])
+
+	#	Encoded object records
+	#
+	def records(self):
+		import srec
+
+		recs = []
+		for start, unit, run in self.runs:
+			recs.extend(srec.encode(run, start, REC_BYTES, unit, end = False))
+
+		for addr, name, relative in self.labels:
+			recs.append(srec.srecL(addr, name, srec.REC_RELOC_LABEL if relative else srec.REC_LABEL))
+
+		for addr, width in self.relocs:
+			recs.append(srec.srecR(addr, width))
+
+		for addr, width, name in self.imports:
+			recs.append(srec.srecI(addr, width, name))
+
+		return recs
+
+	def text(self):
+		recs = self.records()
+		self.count = len(recs)
+		return "".join(r + "\n" for r in recs)
+
+	#	Write the object file
+	#
+	def close(self):
+		if self.name is None:
+			return																			# ------>
+
+		replaceFile(self.name, self.text())
+		isaTables.pop(os.path.abspath(self.name), None)	# ? an instruction set, load it again
+		self.files.append(self.name)
+
+		if self.binary:
+			self.writeImage(self.name.rpartition(".")[0])
+
+	#	Flat memory image, ram for programs or microcode words if any mc runs
+	#
+	def image(self):
+		mc = any(unit == 4 for start, unit, run in self.runs)
+		image = bytearray(MC_WORDS * 4 if mc else RAM_BYTES)
+
+		self.outside = []
+		for start, unit, run in self.runs:
+			a = start * unit
+			if a + len(run) > len(image):
+				self.outside.append([start, len(image)])
+				continue																	# <-------
+			image[a:a + len(run)] = run
+
+		return image
+
+	def writeImage(self, base):
+		replaceFile(base + OUT_BIN, self.image())
+		replaceFile(base + OUT_SYM, "".join("{:08x} {}\n".format(addr, name) for addr, name, relative in self.labels))
+
+		self.files += [base + OUT_BIN, base + OUT_SYM]
+
+
+#
+#	Instruction set from an .obj file, through its compiled .isa file
+#
+#	The .isa file holds the instruction table with the .obj size, mtime & hash, and is
+#	used when the .obj is unchanged: same size & mtime, or else the same content hash.
+#	Otherwise the .obj is parsed and the .isa rewritten.
+#
+#	Returns [content hash, {instruction: [opcode, operand bytes]}] or None
+#
+ISA_SUFFIX = ".isa"
+ISA_VERSION = 1
+
+def loadInstructions(name):
 
-	iCount = 0
 	try:
-		f = open(name)																# ? .obj file
-	except:
-		print("\n{} instructions {} file not found".format(name))
+		st = os.stat(name)														# ? .obj file
+	except OSError:
 		return																				# ------>
 
-	for line in f:
-		if line.startswith("S"):											# srec format
-			addr, label = srec.parse(line)
-		elif line.startswidth(":")	:									# ihex format
-			addr, label = ihex.parse(line)
+	isa = name.rpartition(".")[0] + ISA_SUFFIX
+	try:
+		with open(isa, "rb") as f:
+			c = marshal.load(f)
+		if c["version"] != ISA_VERSION:
+			c = None
+	except (OSError, EOFError, ValueError, TypeError, KeyError):
+		c = None
+
+	if c and c["size"] == st.st_size and c["mtime"] == st.st_mtime_ns:
+		return [c["hash"], c["table"]]								# ------>
+
+	with open(name, "rb") as f:
+		obj = f.read()
+	h = hashlib.sha256(obj).hexdigest()
+
+	if not c or c["hash"] != h:										# ? changed, parse the .obj
+		c = {"version": ISA_VERSION, "hash": h, "table": parseInstructions(obj.decode())}
+
+	c["size"] = st.st_size
+	c["mtime"] = st.st_mtime_ns
+	try:
+		with open(isa + ".tmp", "wb") as f:
+			marshal.dump(c, f)
+		os.replace(isa + ".tmp", isa)
+	except OSError:																	# read only, parse again next time
+		pass
+
+	return [c["hash"], c["table"]]
+
+
+#
+#	Instruction set for an .obj, from isaTables while its size & mtime are unchanged
+#	Returns [content hash, {instruction: [opcode, operand bytes]}] or None
+#
+def isaTable(name):
+
+	try:
+		st = os.stat(name)
+	except OSError:
+		return None																		# ------>
+
+	path = os.path.abspath(name)
+	key = (st.st_size, st.st_mtime_ns)
+	t = isaTables.get(path)
+	if t is not None and t[0] == key:
+		return t[1:]																	# ------>
+
+	isa = loadInstructions(name)
+	if isa is not None:
+		isaTables[path] = [key] + isa
+
+	return isa
 
-		if not isinstance(label ,str):								# ? label
-			continue																		# <-------
 
-		if label.endswith(".instr"):									# labels created by mch in runDirectives
-			instr = addr
-		elif label.endswith(".obytes"):
-			instructions.update({label[0:-7]: [instr, addr]})
-			iCount += 1
+#
+#	read instruction information from microcode.obj labels, srec or ihex
+#		label.instr			opcode
+#		label.obytes		bytes per operand
+#
+def parseInstructions(text):
+	import loader
+
+	symbols = loader.load(text.splitlines()).symbols
+
+	table = {}
+	for label, addr in symbols.items():
+		if label.endswith(".obytes"):								# labels created by mch in runDirectives
+			name = label[0:-7]
+			table[name] = [symbols.get(name + ".instr", 0), addr]
+
+	return table
+
+
+#
+#	Assemble one source file with its listing & diagnostics captured
+#	Runs in the worker processes, returns (text, errors, stats summary or None)
+#
+def assembleCaptured(task):
+	import traceback
+
+	name, passes, cache, binary, reloc, stats = task
+	out = io.StringIO()
+	a = Assembler(out, passes, cache, binary, reloc, stats)
+	try:
+		errors = a.assembleFile(name)
+	except Exception:																# report, don't stop the other files
+		traceback.print_exc(file = out)
+		errors = 1
+
+	return out.getvalue(), errors, a.stats and a.stats.summary()
+
 
-	f.close()
+#
+#	Worker process start, share the instruction sets loaded by the parent
+#
+def initWorker(tables):
 
-	print("\n{} instructions loaded from {}".format(iCount, name))
+	isaTables.update(tables)
 
 	return
 
 
 #
+#	Build order, sources writing an .obj another source imports with isa come first
+#	Returns lists of sources in source order, each depending only on the lists before it,
+#	and the imported .obj paths no source in names writes
 #
+LEX_ISA = re.compile(r"^[^\s;]*[ \t]+isa[ \t]+([^\s;,]+)", re.M)
+
+def buildWaves(names, suffix = OUT_OBJ):
+
+	objs = {os.path.abspath(n.partition(".")[0] + suffix): n for n in names}
+
+	needs = {}
+	imports = set()
+	for n in names:
+		try:
+			with open(n.partition(".")[0] + ".asm") as f:
+				isas = LEX_ISA.findall(f.read())
+		except OSError:																# reported when assembled
+			isas = []
+		paths = {os.path.abspath(i.partition(".")[0] + ".obj") for i in isas}
+		needs[n] = {objs[p] for p in paths if p in objs and objs[p] != n}
+		imports.update(p for p in paths if p not in objs)
+
+	waves = []
+	done = set()
+	left = list(names)
+	while left:
+		wave = [n for n in left if needs[n] <= done] or left		# ? a cycle, build the rest together
+		waves.append(wave)
+		done.update(wave)
+		left = [n for n in left if n not in done]
+
+	return waves, imports
+
+
+#
+#	Assemble several sources across a process pool
+#	Listings are printed in build order, see buildWaves, returns the total errors
+#	Each wave of sources finishes before the next, which may import its instruction sets
+#	Instruction sets no source here writes are loaded once, before the pool, & passed to its workers
+#	stats, a dict to fill with each source's Stats summary
 #
-file = sys.argv[1]
-asmFile(file, 1)																	# pass 1
-asmFile(file, 2)																	# pass 2
-listLabels()
+def assembleAll(names, passes = 1, cache = True, jobs = None, binary = False, reloc = False, stats = None):
+
+	waves, imports = buildWaves(names, OUT_REL if reloc else OUT_OBJ)
+	errors = 0
+
+	if len(names) == 1 or jobs == 1:								# ? no point in a pool
+		for wave in waves:
+			for n in wave:
+				a = Assembler(sys.stdout, passes, cache, binary, reloc, stats is not None)
+				errors += a.assembleFile(n)
+				if a.stats:
+					stats[n] = a.stats.summary()
+		return errors																	# ------>
+
+	for p in sorted(imports):
+		isaTable(p)																		# ? missing, reported when assembled
+
+	import multiprocessing
+	with multiprocessing.Pool(jobs, initWorker, (isaTables,)) as pool:
+		for wave in waves:
+			tasks = [(n, passes, cache, binary, reloc, stats is not None) for n in wave]
+			for t, (text, e, summary) in zip(tasks, pool.imap(assembleCaptured, tasks)):
+				sys.stdout.write(text)
+				errors += e
+				if summary:
+					stats[t[0]] = summary
+
+	return errors
+
+
+#
+#	asm.py source... [-2] [-b] [-r] [-j jobs] [--isa name] [--no-cache] [--stats [file]]
+#
+def main(argv = None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description = "Microcode table driven assembler")
+	parser.add_argument("sources", nargs = "+", help = "source files, .asm assumed")
+	parser.add_argument("-2", "--two-pass", dest = "passes", action = "store_const", const = 2, default = 1,
+											help = "re-read the source in a second pass instead of patching forward references")
+	parser.add_argument("--no-cache", dest = "cache", action = "store_false",
+											help = "always assemble, don't read or update the build cache")
+	parser.add_argument("-j", "--jobs", type = int, default = None,
+											help = "worker processes for several sources, default all cores")
+	parser.add_argument("--isa", action = "append", default = [],
+											help = "extra instruction set shared by the workers, those imported with isa are preloaded")
+	parser.add_argument("-b", "--binary", action = "store_true",
+											help = "also write a flat .bin memory image and .sym symbol table")
+	parser.add_argument("-r", "--reloc", action = "store_true",
+											help = "write a relocatable .rel module for link.py")
+	parser.add_argument("--stats", nargs = "?", const = "-", default = None, metavar = "FILE",
+											help = "JSON phase times & counters, to a file or after the listing")
+	args = parser.parse_args(argv)
+
+	for i in args.isa:
+		isaTable(i.partition(".")[0] + ".obj")
+
+	stats = None if args.stats is None else {}
+	errors = assembleAll(args.sources, args.passes, args.cache, args.jobs, args.binary, args.reloc, stats)
+
+	if stats is not None:
+		total = Stats()
+		for summary in stats.values():
+			total.add(summary)
+		text = json.dumps({"files": stats, "total": total.summary(), "errors": errors}, indent = 1)
+
+		if args.stats == "-":
+			print(text)
+		else:
+			with open(args.stats, "w") as f:
+				f.write(text + "\n")
+
+	return 1 if errors else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
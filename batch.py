@@ -0,0 +1,135 @@
+"""
+
+Batch runner
+
+Runs assembled programs across a process pool, each on its own sim.CPU with the
+microcode loaded once per worker, until it halts or uses its cycle budget, and writes
+every program's final state to one JSON results file
+
+	batch.py program.obj... [--microcode microcode.obj] [--pc start] [--cycles n]
+		[--mode blocks] [-j jobs] [--out results.json]
+
+Each result, in program order
+	program				file name
+	halted				True if it halted, False if it used its budget
+	instructions	executed
+	cycles
+	seconds				run time, loading excluded
+	registers			{name: value} as sim.SNAP_REGISTERS
+	ram						crc32 of the 64K ram, hex
+	error					why it couldn't be loaded or run, else None
+
+"""
+
+import sys
+import time
+import json
+import zlib
+import sim
+
+
+RESULTS = "results.json"
+
+cpu = None																				# the worker process's CPU
+settings = None																		# (pc, cycles, mode)
+
+
+#
+#	Worker process start, load the microcode once
+#
+def initWorker(microcode, pc, cycles, mode):
+	global cpu, settings
+
+	cpu = sim.CPU()
+	cpu.loadMicrocode(microcode)
+	settings = (pc, cycles, mode)
+
+	return
+
+
+#
+#	Run one program from reset, returns its result
+#
+def runProgram(name):
+
+	pc, cycles, mode = settings
+	result = {"program": name, "halted": False, "instructions": 0, "cycles": 0, "seconds": 0,
+		"registers": None, "ram": None, "error": None}
+
+	try:
+		symbols = cpu.loadProgram(name)
+		cpu.reset(sim.startAddress(pc, symbols))
+
+		t = time.perf_counter()
+		n = cpu.run(cycles, mode)
+		t = time.perf_counter() - t
+	except Exception as e:													# report, don't stop the other programs
+		result["error"] = "{}: {}".format(type(e).__name__, e)
+		return result																	# ------>
+
+	r = cpu.reg
+	result.update(
+		halted = r.halted,
+		instructions = n,
+		cycles = r.cycles,
+		seconds = round(t, 6),
+		registers = {k: getattr(r, k) for k in sim.SNAP_REGISTERS},
+		ram = "{:08x}".format(zlib.crc32(cpu.ram)),
+	)
+
+	return result
+
+
+#
+#	Run programs across a process pool, returns their results in program order
+#
+def runAll(names, microcode = "microcode.obj", pc = "start", cycles = 1000000, mode = sim.MODE_BLOCKS, jobs = None):
+
+	init = (microcode, pc, cycles, mode)
+
+	if len(names) == 1 or jobs == 1:								# ? no point in a pool
+		initWorker(*init)
+		return [runProgram(n) for n in names]					# ------>
+
+	import multiprocessing
+	jobs = jobs or multiprocessing.cpu_count()
+	with multiprocessing.Pool(jobs, initWorker, init) as pool:
+		return pool.map(runProgram, names, chunksize = max(1, len(names) // (4 * jobs)))
+
+
+#
+#	batch.py program... [--microcode name] [--pc addr] [--cycles n] [--mode m] [-j jobs] [--out file]
+#
+def main(argv = None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description = "Run many programs across a process pool")
+	parser.add_argument("programs", nargs = "+", help = "program .obj or 64K .bin images")
+	parser.add_argument("--microcode", default = "microcode.obj", help = "microcode .obj or .bin")
+	parser.add_argument("--pc", default = "start", help = "start address or label, $hex allowed")
+	parser.add_argument("--cycles", type = int, default = 1000000, help = "cycle budget per program")
+	parser.add_argument("--mode", choices = sim.MODES, default = sim.MODE_BLOCKS, help = "simulator run mode")
+	parser.add_argument("-j", "--jobs", type = int, default = None, help = "worker processes, default every core")
+	parser.add_argument("--out", default = RESULTS, help = "results file")
+	args = parser.parse_args(argv)
+
+	t = time.perf_counter()
+	results = runAll(args.programs, args.microcode, args.pc, args.cycles, args.mode, args.jobs)
+	t = time.perf_counter() - t
+
+	with open(args.out, "w") as f:
+		json.dump({"microcode": args.microcode, "cycles": args.cycles, "mode": args.mode, "results": results}, f, indent = 1)
+
+	halted = sum(1 for r in results if r["halted"])
+	errors = sum(1 for r in results if r["error"])
+	for r in results:
+		if r["error"]:
+			print("{}: {}".format(r["program"], r["error"]))
+	print("{} programs, {} halted, {} out of cycles, {} errors, {:.2f} sec".format(
+		len(results), halted, len(results) - halted - errors, errors, t))
+
+	return 1 if errors else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
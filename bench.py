@@ -0,0 +1,376 @@
+"""
+
+Assembler benchmark
+
+Generates a large source against the microcode.obj instruction set and times each
+assembler phase separately, then a whole assembly with its peak memory
+
+	bench.py [lines...] [--seed n] [--history file] [--no-history]
+
+	baseline	the original split & rstrip parseLine then instrKey, before the single scan lexer
+	parse			Assembler.parseLine
+	resolve		Assembler.resolveOpers, every label defined
+	assemble	Assembler.assembleLine into an ObjWriter
+	srec			ObjWriter.text, the object file records
+	total			Assembler.assembleString, one pass from cold caches
+
+Results are appended to the history file, one JSON object per run, and compared with
+the last run of the same size so regressions show up between runs.
+
+"""
+
+import sys
+import time
+import json
+import random
+import platform
+import tracemalloc
+import asm
+import expr
+
+
+HISTORY = "bench.jsonl"
+ISA = "microcode.obj"
+SLOWER = 0.10																			# fraction slower flagged as a regression
+
+
+#
+#	Generated source, one block per global label
+#		{0} block, {1} next block, {2} random instructions
+#
+#	Forward references to the next block, .fwd and msg, locals, strings & expressions
+#
+BLOCK = """blk{0}	ld	t,#blk{1}					; forward to the next block
+.1		dc.b	"block {0}", 0
+.2		ld	t,msg{0} + 2
+		jsr	.fwd
+{2}		dword	$1 << 31, %11 << 29, blk{0} * 2
+.fwd	bne	blk{0}
+		dc.w	.1, .2, .fwd + 2
+msg{0} = blk{0} + $20
+"""
+
+#
+#	Instruction forms as written, used when the instruction set has their key
+#
+TEMPLATES = (
+	"ld	t,#{0}",
+	"ld	t,{0}",
+	"jsr	({0})",
+	"lda	({0}),y",
+	"lda	({0},x)",
+	"tx	t,a",
+)
+
+#
+#	Operand expressions, {0} block, {1} next block
+#
+OPERANDS = (
+	"blk{0}",
+	"blk{1}",
+	".1",
+	".fwd",
+	"msg{0}",
+	"$d800",
+	"%1010",
+	"blk{0} + 4 * 2",
+	"msg{0} >> 1",
+	"$ff & blk{1} + 1",
+)
+
+
+#
+#	Instruction lines a block picks from, templates in the isa and every isa key as written
+#	A key with no registers is also a valid mnemonic, eg. ld.t# $10
+#
+def forms(table):
+
+	lines = []
+	for t in TEMPLATES:
+		instr, key, opers = asm.parseStatement(t.format("1"))
+		if key in table:
+			lines.append(t)
+
+	for key, (opcode, operBytes) in sorted(table.items()):
+		lines.append(key + ("	{0}" if operBytes else ""))
+
+	return lines
+
+
+#
+#	Return a list of about n source lines, whole blocks
+#
+def source(n, seed = 0, table = None):
+
+	if table is None:
+		isa = asm.loadInstructions(ISA)
+		if isa is None:
+			raise SystemExit("{} not found, assemble microcode.asm first".format(ISA))
+		table = isa[1]
+
+	rnd = random.Random(seed)
+	lines = forms(table)
+
+	out = ["		isa	{}\n".format(ISA)]
+	i = 0
+	while len(out) < n:
+		body = ""
+		for j in range(rnd.randint(2, 8)):
+			form = rnd.choice(lines)
+			oper = rnd.choice(OPERANDS)
+			if oper[0] == "." and ("#{0}" in form or "({0}" in form):
+				oper = OPERANDS[0]												# .local only expands leading the operand
+			body += "		" + form.format(oper.format(i, i + 1)) + "\n"
+		out += BLOCK.format(i, i + 1, body).splitlines(True)
+		i += 1
+
+	out.append("blk{}\n".format(i))													# last forward reference
+
+	return out
+
+
+#
+#	Original lexer, label & instruction split with find & partition, to compare with parse
+#	Returns [number, label, instruction key, operands, address, ins, bytes] as it did
+#
+def baselineParseLine(source, labels):
+	label = ""
+	instr = ""
+	opers = []
+
+	source = source.rstrip(" \t\n")									# discard carriage control
+	source = asm.expandStrings(source)							# convert quoted strings to lists of chars
+	source = source.partition(";")[0]								# discard comments
+	source = source.replace("\t", " ")							# remove tabs to simplify later finds
+
+	#	First word on the line is a label
+	#
+	i = source.find(" ")														# ? label - word at the beginning of the line
+	if i == -1: i = len(source)
+	if i>0:
+		label = source[0:i]
+
+		if label[0].startswith("."):									# ? .local label
+			label = labels[asm.LABEL_SCOPE] + "_" + label[1:]
+		else:																					# else normal label
+			labels[asm.LABEL_SCOPE] = label							# save for the next local definition
+
+	#	Second word is an instruction
+	#
+	source = source[i:].strip()											# remove leading whitespace
+	j = source.find(" ")
+	if j == -1: j = len(source)
+	instr = source[:j]
+
+	# Third onwards are operands
+	#
+	source = source[j:].strip()
+	if source == "":
+		opers = []
+	else:
+		opers = source.split(",")											# separate operands, leaves [''] if given an empty string
+		opers = [o.strip() for o in opers]
+
+	line = [0, label, instr, opers, 0, [0, 0, 0], []]
+	baselineInstrKey(line)
+
+	return line
+
+
+def baselineInstrKey(line):
+
+	if line[2] == "":																# no instruction
+		return
+
+	key = line[2] + "."
+	for o in line[3]:
+		o0 = str(o)[0]
+
+		if o in asm.registers		: key += o
+		if key == "mc"					:	key += "mc"
+		if o0 == "#"						:	key += "#"
+		if o0 == "("						: key += "("
+
+	line[2] = key.strip(".")
+
+	return
+
+
+#
+#	Seconds for each phase over the lines
+#
+def benchPhases(lines):
+
+	a = asm.Assembler(listing = None)
+	a.assembleStream(lines)													# labels & isa, warms the caches
+	labels = a.labels
+
+	#	Original parseLine & instrKey
+	#
+	scope = {asm.LABEL_SCOPE: ""}
+
+	t = time.perf_counter()
+	for s in lines:
+		baselineParseLine(s, scope)
+	tBaseline = time.perf_counter() - t
+
+	#	parseLine
+	#
+	p = asm.Assembler(listing = None)
+	p.labels[asm.LABEL_SCOPE] = ""
+	parse = p.parseLine
+
+	t = time.perf_counter()
+	for s in lines:
+		parse(s)
+	tParse = time.perf_counter() - t
+
+	parsed = []																			# [line, scope] not timed
+	for s in lines:
+		parsed.append([parse(s), p.labels[asm.LABEL_SCOPE]])
+
+	#	resolveOpers
+	#
+	resolve = a.resolveOpers
+
+	t = time.perf_counter()
+	for line, scope in parsed:
+		labels[asm.LABEL_SCOPE] = scope
+		resolve(line)
+	tResolve = time.perf_counter() - t
+
+	#	assembleLine, lines as pass 2 sees them
+	#
+	labels["*"] = 0
+	labels[asm.LABEL_SCOPE] = ""
+	ready = [a.asmLine(s, ln) for ln, s in enumerate(lines, 1)]
+	out = asm.ObjWriter()
+	assemble = a.assembleLine
+
+	t = time.perf_counter()
+	for line in ready:
+		assemble(line, out)
+	tAssemble = time.perf_counter() - t
+
+	#	SREC records
+	#
+	t = time.perf_counter()
+	text = out.text()
+	tSrec = time.perf_counter() - t
+
+	return {"baseline": tBaseline, "parse": tParse, "resolve": tResolve, "assemble": tAssemble, "srec": tSrec}, len(text)
+
+
+#
+#	Seconds for a whole assembly from cold caches and its peak traced memory
+#
+def benchTotal(lines):
+
+	asm.statements.clear()
+	expr.cache.clear()
+	expr.scopes.clear()
+
+	a = asm.Assembler(listing = None)
+	t = time.perf_counter()
+	a.assembleStream(lines)
+	t = time.perf_counter() - t
+	errors = a.errors
+
+	asm.statements.clear()
+	expr.cache.clear()
+	expr.scopes.clear()
+
+	tracemalloc.start()
+	a = asm.Assembler(listing = None)
+	a.assembleStream(lines)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return t, peak, errors
+
+
+#
+#	Last history entry for a source size, or None
+#
+def lastRun(name, n):
+
+	last = None
+	try:
+		with open(name) as f:
+			for line in f:
+				try:
+					run = json.loads(line)
+				except ValueError:
+					continue																# <-------
+				if run.get("lines") == n:
+					last = run
+	except OSError:
+		pass
+
+	return last
+
+
+#
+#	Benchmark one source size, print & return its results
+#
+def bench(n, seed = 0, history = None):
+
+	lines = source(n, seed)
+
+	total, peak, errors = benchTotal(lines)
+	phases, size = benchPhases(lines)
+	phases["total"] = total
+
+	run = {
+		"time":			time.strftime("%Y-%m-%d %H:%M:%S"),
+		"python":		platform.python_version(),
+		"lines":		n,
+		"seed":			seed,
+		"rate":			{k: round(len(lines) / t) for k, t in phases.items()},
+		"peak":			peak,
+		"objBytes":	size,
+	}
+
+	last = lastRun(history, n) if history else None
+
+	print("\n{} lines, {} errors, {} byte object, {:.1f} MB peak".format(
+		n, errors, size, peak / 1e6))
+	for k, rate in run["rate"].items():
+		s = "{:10} {:>12,} lines/sec".format(k, rate)
+		if last and last["rate"].get(k):
+			change = rate / last["rate"][k] - 1
+			s += "  {:+6.1%}".format(change)
+			if change < -SLOWER:
+				s += "  slower"
+		print(s)
+
+	if history:
+		with open(history, "a") as f:
+			f.write(json.dumps(run) + "\n")
+
+	return run
+
+
+#
+#	bench.py [lines...] [--seed n] [--history file] [--no-history]
+#
+def main(argv = None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description = "Assembler throughput benchmark")
+	parser.add_argument("lines", nargs = "*", type = int, default = [10000, 100000],
+		help = "generated source sizes, 10k to 1M")
+	parser.add_argument("--seed", type = int, default = 0, help = "source generator seed")
+	parser.add_argument("--history", default = HISTORY, help = "results history file")
+	parser.add_argument("--no-history", action = "store_true", help = "don't read or write the history")
+	args = parser.parse_args(argv)
+
+	history = None if args.no_history else args.history
+	for n in args.lines:
+		bench(n, args.seed, history)
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
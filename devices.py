@@ -0,0 +1,240 @@
+"""
+
+Memory mapped devices
+
+Devices claim address ranges on a sim.CPU, reads & writes there go to the device
+instead of ram.  The CPU keeps a 256 entry page table, so reads off a device page
+stay on the plain ram path, and writes reach a device through the same byte map
+that catches writes over translated code, see sim.CPU.attach.
+
+i.e.
+	cpu = sim.CPU()
+	devices.standard(cpu, disk = "disk.img")				-> console, timer & block device
+	cpu.loadMicrocode("microcode.obj")
+
+Standard map, the page below the kernal style vectors, eg. chrout $ffd2 & chrin $ffcf
+	$fe00		console		+0 data, write outputs a byte, read the next input byte or 0
+										+1 status, bit 0 input ready, bit 1 output ready
+	$fe10		timer			+0-3 cycle count little endian, latched when +0 is read
+	$fe20		block			+0-1 block number, +2-3 ram address, +4 command, +5 status
+										commands 1 read a block into ram, 2 write one from ram, 3 flush
+										status 0 ok, 1 error
+
+Console output is buffered & written a line or buffer full at a time, and at the end of
+each run.  Input is read as much as is available at a time, a data read waits for input
+but a status read never does.  The timer counts cycles at the start of the instruction,
+or translated block, reading it.
+
+Block reads land in ram through the CPU's write trap, as any memory write does, so they
+hit watchpoints & drop translated code they cover.
+
+"""
+
+import io
+import os
+import sys
+import select
+
+
+IO_BASE = 0xfe00
+
+CONSOLE_BASE = IO_BASE
+TIMER_BASE = IO_BASE + 0x10
+BLOCK_BASE = IO_BASE + 0x20
+
+CONSOLE_BUFFER = 4096
+INPUT_BUFFER = io.DEFAULT_BUFFER_SIZE								# at least the stream's, read1 empties it
+BLOCK_BYTES = 512
+
+BLOCK_READ = 1																		# commands
+BLOCK_WRITE = 2
+BLOCK_FLUSH = 3
+
+
+#
+#	A device on size addresses from base, offsets from base passed to read & write
+#
+class Device:
+
+	size = 1
+
+	def __init__(self, base):
+		self.base = base
+		self.cpu = None
+
+	#	Claimed on a cpu
+	#
+	def attach(self, cpu):
+		self.cpu = cpu
+
+	#	Byte at an offset
+	#
+	def read(self, offset):
+		return 0
+
+	#	Byte written to an offset
+	#
+	def write(self, offset, value):
+		pass
+
+	#	Write out anything buffered, at the end of each run
+	#
+	def flush(self):
+		pass
+
+	def close(self):
+		self.flush()
+
+
+#
+#	Console, bytes out to a text stream, in from a binary stream
+#
+class Console(Device):
+
+	size = 2
+
+	def __init__(self, base = CONSOLE_BASE, out = None, input = None):
+		super().__init__(base)
+		self.out = sys.stdout if out is None else out
+		self.input = input														# binary stream, or None
+		self.outBuffer = bytearray()
+		self.inBuffer = b""
+		self.inPos = 0
+
+	#	Refill the input buffer with what is available, waiting for at least a byte
+	#	False at the end of input
+	#
+	def fill(self):
+		if self.inPos < len(self.inBuffer):
+			return True																	# ------>
+		if self.input is None:
+			return False																# ------>
+
+		read = getattr(self.input, "read1", self.input.read)
+		self.inBuffer = read(INPUT_BUFFER) or b""
+		self.inPos = 0
+		if not self.inBuffer:
+			self.input = None
+		return bool(self.inBuffer)
+
+	#	True if a fill wouldn't wait, streams without a file descriptor never do
+	#
+	def ready(self):
+		if self.inPos < len(self.inBuffer):
+			return True																	# ------>
+		if self.input is None:
+			return False																# ------>
+
+		try:
+			return bool(select.select([self.input.fileno()], [], [], 0)[0])
+		except (AttributeError, OSError, ValueError):	# ? no descriptor, eg. BytesIO
+			return True
+
+	def read(self, offset):
+		if offset == 0:
+			if not self.fill():
+				return 0																# ------>
+			self.inPos += 1
+			return self.inBuffer[self.inPos -1]
+		return 2 | (1 if self.ready() and self.fill() else 0)
+
+	def write(self, offset, value):
+		if offset == 0:
+			self.outBuffer.append(value)
+			if value == 10 or len(self.outBuffer) >= CONSOLE_BUFFER:
+				self.flush()
+
+	def flush(self):
+		if self.outBuffer:
+			self.out.write(self.outBuffer.decode("latin-1"))
+			self.out.flush()
+			self.outBuffer.clear()
+
+
+#
+#	Cycle counter
+#
+class Timer(Device):
+
+	size = 4
+
+	def __init__(self, base = TIMER_BASE):
+		super().__init__(base)
+		self.latch = 0
+
+	def read(self, offset):
+		if offset == 0:
+			self.latch = self.cpu.reg.cycles & 0xffffffff
+		return self.latch >> 8 * offset & 0xff
+
+
+#
+#	Block storage backed by a file, whole blocks copied to & from ram
+#	Created if it doesn't exist, reads past its end are zeros
+#
+class BlockDevice(Device):
+
+	size = 6
+
+	def __init__(self, name, base = BLOCK_BASE):
+		super().__init__(base)
+		self.name = name
+		self.file = open(name, "r+b" if os.path.exists(name) else "w+b")
+		self.regs = bytearray(self.size)
+		self.busy = False															# in a command, eg. reading over its registers
+
+	def read(self, offset):
+		return self.regs[offset]
+
+	def write(self, offset, value):
+		self.regs[offset] = value
+		if offset == 4 and not self.busy:
+			self.busy = True
+			try:
+				self.command(value)
+			finally:
+				self.busy = False
+
+	def command(self, value):
+		block = self.regs[0] | self.regs[1] << 8
+		addr = self.regs[2] | self.regs[3] << 8
+		ram = self.cpu.ram
+		status = 0
+		try:
+			if value == BLOCK_READ:
+				self.file.seek(block * BLOCK_BYTES)
+				data = self.file.read(BLOCK_BYTES).ljust(BLOCK_BYTES, b"\0")
+				n = min(BLOCK_BYTES, len(ram) - addr)				# wraps at $ffff
+				ram[addr:addr + n] = data[:n]
+				ram[:BLOCK_BYTES - n] = data[n:]
+				self.cpu.writeTrap(addr, BLOCK_BYTES)				# watched, translated code or devices
+			elif value == BLOCK_WRITE:
+				n = min(BLOCK_BYTES, len(ram) - addr)
+				self.file.seek(block * BLOCK_BYTES)
+				self.file.write(ram[addr:addr + n] + ram[:BLOCK_BYTES - n])
+			elif value == BLOCK_FLUSH:
+				self.file.flush()
+			else:
+				status = 1
+		except OSError:
+			status = 1
+		self.regs[5] = status
+
+	def flush(self):
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+
+#
+#	Console, timer & a block device if a disk file is given at the standard addresses
+#
+def standard(cpu, out = None, input = None, disk = None):
+
+	cpu.attach(Console(out = out, input = input))
+	cpu.attach(Timer())
+	if disk:
+		cpu.attach(BlockDevice(disk))
+
+	return
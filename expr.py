@@ -0,0 +1,201 @@
+"""
+
+Operand expressions
+Compile assembler operand text once into a python function, cached by the operand text
+
+Syntax
+	$ffd2				hex
+	%1010				binary
+	# ( )				addressing mode markers, ignored
+	. -					part of a label name, not an operator
+	.local			leading . is prefixed with the current scope label
+
+Evaluation looks names up in the symbol table directly, no text rewriting or
+exceptions on the hot path.  Any name without an integer value returns PENDING.
+A bare name or number needs no compiling, anything else is compiled once as a lambda
+with its names replaced by symbol table lookups.
+
+"""
+
+import re
+import keyword
+
+
+#
+#	Returned for operands referring to symbols not defined yet
+#
+class Pending:
+
+	def __repr__(self):
+		return "PENDING"
+
+	def __bool__(self):
+		return False
+
+
+PENDING = Pending()
+
+
+#
+#	Compiled operands by source text
+#		[constant, function, label names, local name]
+#
+EXPR_CONST		= 0								# value if no names, else PENDING
+EXPR_FN				= 1								# fn(symbols, local) or None
+EXPR_NAMES		= 2								# tuple of label names referenced
+EXPR_LOCAL		= 3								# .local name suffix or None
+
+cache = {
+}
+
+scopes = {												# scope label -> formatted local prefix
+}
+CACHE_MAX = 0x4000								# entries, about 1K each, cleared when full as asm.statements
+
+LEX_NAME = re.compile(r"\b[A-Za-z_]\w*")
+
+
+#
+#	Format operators for python
+# 	()#$ to 0x 0b
+#		. - to _					python interprets . as method call, - as operator
+#
+def formatOper(o):
+
+	o = o.replace("#","").replace("(","").replace(")","")
+	o = o.replace("$","0x").replace("%","0b")
+	o = o.replace(".","_").replace("-","_")
+
+	return o
+
+
+#
+#	Symbol table lookup for a bare name or .local
+#
+def nameFn(name):
+	return lambda L, S: L[name]
+
+def localFn(L, S):
+	return L[S]
+
+
+#
+#	Compile one operand and add it to the cache
+#		name			-> L["name"]
+#		.local		-> L[S]				S is the scoped name passed at evaluation
+#
+def compileOper(o):
+
+	local = o.startswith(".")
+	e = [PENDING, None, (), None]
+	f = formatOper(o)
+
+	if len(cache) >= CACHE_MAX:											# ? bound the cache on huge sources
+		cache.clear()
+	cache[o] = e
+
+	if f.isidentifier() and not keyword.iskeyword(f):	# ? bare name
+		if local:
+			e[EXPR_FN] = localFn
+			e[EXPR_LOCAL] = f
+		else:
+			e[EXPR_FN] = nameFn(f)
+			e[EXPR_NAMES] = (f,)
+		return e																				# ------>
+
+	try:																						# ? bare number
+		e[EXPR_CONST] = int(f, 0)
+		return e																				# ------>
+	except ValueError:
+		pass
+
+	names = []
+	def lookup(m):
+		n = m.group(0)
+		if keyword.iskeyword(n):
+			return n
+		if local and m.start() == 0:										# leading .local
+			e[EXPR_LOCAL] = n
+			return "L[S]"
+		if n not in names:
+			names.append(n)
+		return "L[{!r}]".format(n)
+
+	text = LEX_NAME.sub(lookup, f)
+	try:
+		fn = eval(compile("lambda L, S: " + text, "<operand>", "eval"), {"__builtins__": {}})
+	except SyntaxError:															# never resolves, eg. isa file names
+		e[EXPR_LOCAL] = None
+		return e																				# ------>
+
+	if not names and e[EXPR_LOCAL] is None:					# ? constant, evaluate now
+		try:
+			e[EXPR_CONST] = fn({}, None)
+		except (ArithmeticError, TypeError):
+			pass
+	else:
+		e[EXPR_NAMES] = tuple(names)
+		e[EXPR_FN] = fn
+
+	return e
+
+
+#
+#	Local label prefix for a scope label, formatted as the operand text is
+#
+def scopeKey(scope):
+
+	k = scopes.get(scope)
+	if k is None:
+		if len(scopes) >= CACHE_MAX:
+			scopes.clear()
+		k = scopes[scope] = formatOper(scope)
+
+	return k
+
+
+#
+#	Evaluate an operand against the symbol table
+#	Returns the value or PENDING if any name is undefined
+#
+def evalOper(o, symbols, scope=""):
+
+	e = cache.get(o)
+	if e is None:
+		e = compileOper(o)
+
+	fn = e[EXPR_FN]
+	if fn is None:
+		return e[EXPR_CONST]														# ------>
+
+	for n in e[EXPR_NAMES]:
+		if type(symbols.get(n)) is not int:
+			return PENDING															# ------>
+
+	local = e[EXPR_LOCAL]
+	if local is not None:
+		local = scopeKey(scope) + local
+		if type(symbols.get(local)) is not int:
+			return PENDING															# ------>
+
+	try:
+		return fn(symbols, local)
+	except (ArithmeticError, TypeError):
+		return PENDING
+
+
+
+#
+#	Names an operand refers to, a .local name expanded with the scope
+#
+def operNames(o, scope=""):
+
+	e = cache.get(o)
+	if e is None:
+		e = compileOper(o)
+
+	names = list(e[EXPR_NAMES])
+	if e[EXPR_LOCAL] is not None:
+		names.append(scopeKey(scope) + e[EXPR_LOCAL])
+
+	return names
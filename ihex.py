@@ -10,24 +10,27 @@ R.Lincoln			February 2024
 
 #
 #	Return type 0/6 address/bytes list record
+#	Addresses above $ffff need a type 04 record first, see encode
 #
 def ihex(addr, bytes, type = 0):
 
 	if not isinstance(addr, int): return ""				# ? numeric address
-	if addr > 0xffff: return ""										# ? 32 bit address
+	if addr > 0xffff:															# ? 32 bit address
+		raise ValueError("address ${:x} above $ffff, use encode".format(addr))
+	if len(bytes) > 0xff:													# ? to long
+		raise ValueError("{} bytes, 255 per record".format(len(bytes)))
 
-	n = len(bytes)
-	if n > 0xff: return ""												# ? to long
+	return encodeRecord(type, addr, bytearray(bytes))
 
-	a = "{:04x}".format(addr)											# posit 16 bit address
-	ac = (addr & 255) + (addr >> 8 & 255)					# checksum
 
-	b = "".join("{:02x}".format(x) for x in bytes)
+#
+#	Return one record from its type, 16 bit address & data, hex encoded in bulk
+#
+def encodeRecord(type, addr, data):
 
-	c = n + ac + type + sum(bytes) & 0xff
-	c = (c ^ 255) +1															# 2's complement?  TBC
+	head = bytes((len(data), addr >> 8, addr & 0xff, type))
 
-	return	":{:02x}{}{:02x}{}{:02x}".format(n, a, type, b, c)
+	return ":{}{}{:02x}".format(head.hex(), data.hex(), -(sum(head) + sum(data)) & 0xff)
 
 
 #
@@ -50,21 +53,125 @@ def ihexEOF():
 
 
 #
-#	Return an address and list of bytes or label from an srec
+#	Record types
+#		00 data, 01 end of file, 02 extended segment address, 04 extended linear address
+#		05 start linear address, 0A non standard label, address is its value
+#
+REC_DATA			= 0
+REC_EOF				= 1
+REC_SEGMENT		= 2
+REC_LINEAR		= 4
+REC_START			= 5
+REC_LABEL			= 10
+
+REC_BYTES			= 0xff														# most data bytes per record
+
+
+#
+#	Generator of the records for a whole image, bytes, bytearray or memoryview at base
+#
+#	Records are recordBytes long and split at 64K boundaries, with a type 04 record whenever
+#	the upper 16 address bits change from extended, the reader's value before the first record.
+#	end adds the start address record if start is given and the end of file record.
+#
+def encode(data, base = 0, recordBytes = REC_BYTES, start = None, end = True, extended = 0):
+
+	if not 0 < recordBytes <= REC_BYTES:
+		raise ValueError("{} bytes per record, 1 to 255".format(recordBytes))
+
+	data = memoryview(data)
+	i = 0
+	while i < len(data):
+		addr = base + i
+		if addr >> 16 != extended:										# ? next 64K
+			extended = addr >> 16
+			yield encodeRecord(REC_LINEAR, 0, extended.to_bytes(2, "big"))
+
+		n = min(recordBytes, 0x10000 - (addr & 0xffff), len(data) - i)
+		yield encodeRecord(REC_DATA, addr & 0xffff, data[i:i +n])
+		i += n
+
+	if end:
+		if start is not None:
+			yield encodeRecord(REC_START, 0, start.to_bytes(4, "big"))
+		yield ihexEOF()
+
+
+#
+#	Return a record's type, 16 bit address and data bytes, checking its length & checksum
+#	Raises ValueError on a corrupt record
+#
+def decodeRecord(line):
+
+	line = line.strip()
+	if line[:1] != ":":
+		raise ValueError("not an Intel hex record")
+
+	try:
+		raw = bytes.fromhex(line[1:])								# count, address, type, data, checksum
+	except ValueError:
+		raise ValueError("bad hex digits") from None
+
+	if len(raw) < 5 or raw[0] != len(raw) -5:
+		raise ValueError("bad record length")
+	if sum(raw) & 0xff:														# 2's complement of the sum
+		raise ValueError("bad checksum")
+
+	return raw[3], raw[1] << 8 | raw[2], memoryview(raw)[4:-1]
+
+
+#
+#	Return an address and list of bytes or label from an ihex
 #	addr, [byte,...]
 #
 def parse(line):
 
-	num = int(line[1:3], 16) *2
-	addr = int(line[3:7], 16)
-	type = int(line[7:9], 16)
-	b1 = 9																				# first data byte
+	type, addr, data = decodeRecord(line)
+	bytes = list(data)
 
-	bytes = []
-	for i in range(b1, b1 + num, 2):							# hex char pairs
-		bytes.append(int(line[i:i +2], 16))					# to decimal bytes
-
-	if type == 10:																# types from ihexL, return as a label name
+	if type == REC_LABEL:													# types from ihexL, return as a label name
 		bytes = "".join(chr(x) for x in bytes)
 
 	return addr, bytes
+
+
+#
+#	Generator of (type, address, data) over the lines of a file of any size
+#	Data & label addresses include the last extended segment or linear address
+#	data is a memoryview, blank lines are skipped, stops after the end of file record
+#	Raises ValueError with the line number on the first corrupt record
+#
+def records(lines):
+
+	base = 0
+	for n, line in enumerate(lines, 1):
+		if line.isspace() or not line:
+			continue																		# <-------
+		try:
+			type, addr, data = decodeRecord(line)
+		except ValueError as e:
+			raise ValueError("line {}: {}".format(n, e)) from None
+
+		if type == REC_DATA or type == REC_LABEL:
+			addr += base
+		elif type == REC_SEGMENT:
+			base = int.from_bytes(data, "big") << 4
+		elif type == REC_LINEAR:
+			base = int.from_bytes(data, "big") << 16
+
+		yield type, addr, data
+
+		if type == REC_EOF:
+			return																			# ------>
+
+
+#
+#	Generator of (address, data) for data records & (address, label) for label records
+#
+def decode(lines):
+
+	for type, addr, data in records(lines):
+		if type == REC_DATA:
+			yield addr, data
+		elif type == REC_LABEL:
+			yield addr, str(data, "latin-1")
@@ -0,0 +1,192 @@
+"""
+
+Linker
+Places relocatable modules from asm.py -r, resolves symbols between them and writes
+the final SREC or Intel hex image
+
+i.e.
+	asm -r main.asm lib.asm -> main.rel lib.rel
+	link -o prog.obj --base $100 main.rel lib.rel -> prog.obj
+
+Modules are placed one after another from the base address in the order given.
+Each module's size is its last assembly address, the * label.
+
+Module records, see srec.py
+	S1			data at a module relative address
+	S4			absolute label, eg. = declarations
+	SA			module relative label
+	SB			field to add the module base to
+	SC			field to add an imported symbol to, the field holds the addend
+
+"""
+
+import sys
+import srec
+import ihex
+import asm
+
+
+#
+#	One relocatable module read from its .rel file
+#
+class Module:
+
+	def __init__(self, name):
+		self.name = name
+		self.data = []																# [address, bytearray]
+		self.symbols = {}															# name -> [value, module relative]
+		self.relocs = []															# [field address, width]
+		self.imports = []															# [field address, width, symbol]
+		self.base = 0
+
+		with open(name) as f:
+			try:
+				for type, addr, bytes in srec.records(f):
+					if type == 1 or type == 2 or type == 3:
+						self.data.append([addr, bytearray(bytes)])
+					elif type in srec.LABEL_TYPES:
+						self.symbols[str(bytes, "latin-1")] = [addr, type == srec.REC_RELOC_LABEL]
+					elif type == srec.REC_RELOC:
+						self.relocs.append([addr, bytes[0]])
+					elif type == srec.REC_IMPORT:
+						self.imports.append([addr, bytes[0], str(bytes[1:], "latin-1")])
+			except ValueError as e:											# corrupt record
+				raise ValueError("{} {}".format(name, e)) from None
+
+	#	Bytes used by the module, its last address or the end of its data
+	#
+	def size(self):
+		n = self.symbols.get("*", [0])[0]
+		for addr, bytes in self.data:
+			n = max(n, addr + len(bytes))
+		return n
+
+	#	Add to the field at a module relative address, little endian
+	#
+	def patch(self, addr, width, value):
+		for start, bytes in self.data:
+			if start <= addr and addr + width <= start + len(bytes):
+				i = addr - start
+				v = int.from_bytes(bytes[i:i + width], "little") + value
+				bytes[i:i + width] = (v & (1 << width * 8) -1).to_bytes(width, "little")
+				return True
+		return False
+
+
+#
+#	Link modules into a linker image
+#	Returns (ObjWriter, errors)
+#
+def link(names, base = 0, align = 1, log = print):
+
+	errors = 0
+	modules = [Module(n) for n in names]
+
+	#	Place the modules
+	#
+	addr = base
+	for m in modules:
+		addr = -addr // align * -align								# -ve // modulus to ceiling the divided number
+		m.base = addr
+		addr += m.size()
+
+	#	Global symbols, every label except the assembly address
+	#
+	symbols = {}																		# name -> value
+	ambiguous = set()
+	for m in modules:
+		for label, (value, relative) in m.symbols.items():
+			if label == "*" or label == asm.LABEL_SCOPE:
+				continue																	# <-------
+			if relative:
+				value += m.base
+			if label in symbols and symbols[label] != value:
+				ambiguous.add(label)
+			symbols[label] = value
+
+	#	Relocate and resolve imports
+	#
+	for m in modules:
+		for addr, width in m.relocs:
+			if not m.patch(addr, width, m.base):
+				errors += 1
+				log("{}: relocation at ${:04x} outside the module data".format(m.name, addr))
+
+		for addr, width, label in m.imports:
+			if label not in symbols:
+				errors += 1
+				log("{}: undefined symbol '{}'".format(m.name, label))
+				continue																	# <-------
+			if label in ambiguous:
+				errors += 1
+				log("{}: symbol '{}' defined differently by several modules".format(m.name, label))
+			if not m.patch(addr, width, symbols[label]):
+				errors += 1
+				log("{}: import at ${:04x} outside the module data".format(m.name, addr))
+
+	#	Final image
+	#
+	out = asm.ObjWriter()
+	for m in modules:
+		for addr, bytes in m.data:
+			out.data(m.base + addr, bytes)
+		log("{:20} ${:04x} - ${:04x}".format(m.name, m.base, m.base + m.size()))
+
+	for label, value in symbols.items():
+		if label not in ambiguous:
+			out.label(value, label)
+
+	return out, errors
+
+
+#
+#	Intel hex text for a linked image
+#
+def ihexText(out):
+
+	recs = []
+	extended = 0																		# upper 16 address bits, type 04 records
+	for start, unit, run in out.runs:
+		recs.extend(ihex.encode(run, start, end = False, extended = extended))
+		extended = max(start, start + len(run) -1) >> 16
+
+	for addr, name, relative in out.labels:
+		if addr >> 16 != extended:
+			extended = addr >> 16
+			recs.append(ihex.encodeRecord(ihex.REC_LINEAR, 0, extended.to_bytes(2, "big")))
+		recs.append(ihex.ihexL(addr & 0xffff, name))
+
+	recs.append(ihex.ihexEOF())
+
+	return "".join(r + "\n" for r in recs)
+
+
+#
+#	link.py -o out.obj [--base addr] [--align n] [--ihex] module...
+#
+def main(argv = None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description = "Link relocatable modules from asm.py -r")
+	parser.add_argument("modules", nargs = "+", help = "relocatable modules, .rel assumed")
+	parser.add_argument("-o", "--output", required = True, help = "linked object file")
+	parser.add_argument("--base", default = "0", help = "address of the first module, $hex allowed")
+	parser.add_argument("--align", type = int, default = 1, help = "module start alignment")
+	parser.add_argument("--ihex", action = "store_true", help = "write Intel hex instead of SREC")
+	args = parser.parse_args(argv)
+
+	base = int(args.base.replace("$", "0x"), 0)
+	names = [m.partition(".")[0] + asm.OUT_REL for m in args.modules]
+
+	out, errors = link(names, base, max(1, args.align))
+
+	with open(args.output, "w") as f:
+		f.write(ihexText(out) if args.ihex else out.text())
+
+	print("\nLinked {} modules: {} errors found".format(len(names), errors))
+
+	return 1 if errors else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+
+Memory image loader
+Reads SREC or Intel hex object files, detected from the first record, into a sparse
+paged memory image with the label records in a separate symbol index
+
+i.e.
+	image = loader.load("test.obj")								-> image.read(addr, n), image.symbols
+	image = loader.load("microcode.obj", unit = 4)	-> 32 bit microcode words, 4 bytes per address
+	ram = image.flatten(0, 0x10000)							-> contiguous bytearray
+
+Only pages written to are allocated, 256 bytes or 4K etc, so an image spread across
+a 32 bit address space stays small.  Untouched memory reads as zero.
+
+"""
+
+import bisect
+import itertools
+import srec
+import ihex
+
+
+PAGE_BYTES = 256
+
+
+#
+#	Sparse memory image, byte addressed
+#
+class Image:
+
+	def __init__(self, page = PAGE_BYTES):
+		if page <= 0 or page & (page -1):
+			raise ValueError("page size {} not a power of 2".format(page))
+
+		self.page = page
+		self.shift = page.bit_length() -1
+		self.mask = page -1
+		self.pages = {}																# page number -> bytearray
+		self.symbols = {}															# label -> value
+		self.low = None																# lowest & highest+1 byte written
+		self.high = None
+		self.sorted = None														# [(value, label)] by value, nearest
+
+	#	Copy bytes in at an address, allocating pages as needed
+	#
+	def write(self, addr, data):
+		data = memoryview(data)
+		if not len(data):
+			return																			# ------>
+
+		pages = self.pages
+		size = self.page
+		i = 0
+		while i < len(data):
+			p = addr + i >> self.shift
+			o = addr + i & self.mask
+			n = min(size - o, len(data) - i)
+
+			page = pages.get(p)
+			if page is None:
+				page = pages[p] = bytearray(size)
+			page[o:o +n] = data[i:i +n]
+			i += n
+
+		end = addr + len(data)
+		if self.low is None:
+			self.low, self.high = addr, end
+		else:
+			self.low = min(self.low, addr)
+			self.high = max(self.high, end)
+
+	#	n bytes from an address, zero where never written
+	#
+	def read(self, addr, n):
+		out = bytearray(n)
+		pages = self.pages
+		size = self.page
+		i = 0
+		while i < n:
+			p = addr + i >> self.shift
+			o = addr + i & self.mask
+			c = min(size - o, n - i)
+
+			page = pages.get(p)
+			if page is not None:
+				out[i:i +c] = page[o:o +c]
+			i += c
+
+		return out
+
+	def __getitem__(self, addr):
+		page = self.pages.get(addr >> self.shift)
+		return 0 if page is None else page[addr & self.mask]
+
+	#	Bytes allocated to pages
+	#
+	def allocated(self):
+		return len(self.pages) * self.page
+
+	#	Contiguous copy, from the lowest to the highest address written by default
+	#
+	def flatten(self, start = None, end = None):
+		if self.low is None:
+			return bytearray(0 if end is None or start is None else end - start)	# ------>
+
+		start = self.low if start is None else start
+		end = self.high if end is None else end
+
+		return self.read(start, max(0, end - start))
+
+	#	Label with the highest value at or below an address, or None
+	#
+	def nearest(self, addr):
+		if self.sorted is None:
+			self.sorted = sorted((v, l) for l, v in self.symbols.items())
+
+		i = bisect.bisect_right(self.sorted, (addr, "\U0010ffff")) -1
+		return None if i < 0 else self.sorted[i][1]
+
+	def label(self, addr, name):
+		self.symbols[name] = addr
+		self.sorted = None
+
+
+#
+#	Decoder for the first record of a file, srec or ihex, None if neither
+#
+def detect(line):
+
+	c = line.lstrip()[:1]
+	if c == "S":
+		return srec.decode
+	if c == ":":
+		return ihex.decode
+
+	return None
+
+
+#
+#	Load an object file, or lines of one, into an image
+#		unit			bytes per address, eg. 4 for microcode words
+#		image			add to an existing image instead of a new one
+#
+#	Raises ValueError naming the line of a corrupt record
+#
+def load(source, page = PAGE_BYTES, unit = 1, image = None):
+
+	if image is None:
+		image = Image(page)
+
+	if isinstance(source, str):										# file name
+		with open(source) as f:
+			try:
+				return load(f, page, unit, image)					# ------>
+			except ValueError as e:
+				raise ValueError("{} {}".format(source, e)) from None
+
+	lines = iter(source)
+	head = []																				# leading blank lines & the first record
+	for line in lines:
+		head.append(line)
+		if line.strip():
+			break
+
+	decode = detect(head[-1]) if head else None
+	if decode is None:
+		if head and head[-1].strip():
+			raise ValueError("line {}: not SREC or Intel hex".format(len(head)))
+		return image																	# ------> empty
+
+	write = image.write
+	for addr, data in decode(itertools.chain(head, lines)):
+		if isinstance(data, str):										# label record
+			image.symbols[data] = addr
+		else:
+			write(addr * unit, data)
+
+	image.sorted = None
+
+	return image
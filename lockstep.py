@@ -0,0 +1,336 @@
+"""
+
+Lockstep simulator
+
+Runs N instances of one microcode in lockstep with numpy, to fuzz microcode changes
+against thousands of random register & ram states at once
+
+	lockstep.py [--microcode microcode.obj] [-n instances] [--cycles n] [--seed n]
+		[--fill fraction] [--check n]
+
+i.e.
+	cpu = sim.CPU()
+	cpu.loadMicrocode("microcode.obj")
+	ls = lockstep.Lockstep(cpu, 1000)
+	ls.randomize(seed = 1)
+	ls.run(10000)														-> ls.a, ls.pc, ls.ram[i] etc
+
+Every register is a numpy array over the instances and ram one (instances, 64K) uint8
+array, 64K per instance.  Each step applies one microcode word to every instance at
+once, field by field in the interpreter's order, each instance its own word from its
+own microcode pointer.  Instances on different instructions, or the flag set & clear
+variants of one, stay in step, each field's operation masked to the instances it
+selects.  The alu expressions are the microcode compiler's, see sim.ALU_CODE.
+
+--check runs the first n instances' starting states through the sim.py interpreter
+and reports any register or ram difference.
+
+Needs numpy, unlike the rest of the tools.
+
+"""
+
+import sys
+import time
+import numpy as np
+import sim
+
+
+#	Register names by source & destination field value, see sim.SRC_CODE & DST_CODE
+#	ws is w byte swapped
+#
+SOURCE_NAMES = (None, "a", "b", "t", "r", "o", "pc", "sp", "rsp", "alur", None, "flags", None, "ws", "w", "n")
+DEST_NAMES = (None, "a", "b", "t", "r", "o", "pc", "sp", "rsp", "alu1", "alu2", "flags", None, None, "w", "n")
+
+#	Registers held per instance, as the scalar simulator's
+#
+REGISTERS = sim.SNAP_REGISTERS + ("cycles",)
+
+#	ALU result, carry & overflow expressions compiled to evaluate on arrays
+#
+ALU_EVAL = tuple(None if e is None else tuple(compile(s, "<alu>", "eval") for s in e) for e in sim.ALU_CODE)
+
+
+#
+#	Field values with at least one instance, nop 0 excluded
+#
+def present(field):
+
+	return np.flatnonzero(np.bincount(field, minlength = 16)[1:]) + 1
+
+
+#
+#	N instances of a cpu's microcode
+#	The cpu's microcode is copied & its decoded tables used, its registers & ram aren't
+#
+class Lockstep:
+
+	def __init__(self, cpu, n):
+		self.count = n
+
+		self.words = np.array(cpu.microcode, dtype = np.int64)
+		self.timing = np.array(cpu.timing, dtype = np.int64)
+		self.condition = np.array(cpu.condition, dtype = np.int64)
+		self.empty = np.array(cpu.empty, dtype = bool)
+
+		for r in REGISTERS:
+			setattr(self, r, np.zeros(n, dtype = np.int64))
+		self.halted = np.zeros(n, dtype = bool)
+		self.running = np.ones(n, dtype = bool)						# not halted or out of cycles
+		self.fetch = np.ones(n, dtype = bool)							# at an instruction start
+		self.instructions = np.zeros(n, dtype = np.int64)
+
+		self.ram = np.zeros((n, sim.RAM_BYTES), dtype = np.uint8)
+		self.flat = self.ram.reshape(-1)									# ram[i, a] is flat[base[i] + a]
+		self.base = np.arange(n, dtype = np.int64) * sim.RAM_BYTES
+
+	#
+	#	Random registers, flags & ram, fill the fraction of ram bytes that are opcodes
+	#	with microcode, so instances run rather than halting on their first opcode
+	#	Ram is drawn one instance at a time as uint8, no temporaries the size of all of it
+	#
+	def randomize(self, seed = 0, fill = 0.9):
+
+		rnd = np.random.default_rng(seed)
+		for r in sim.SNAP_REGISTERS:
+			setattr(self, r, rnd.integers(0, 0x10000, self.count, dtype = np.int64))
+		self.flags = rnd.integers(0, 0x40, self.count, dtype = np.int64)
+		self.mcp[:] = 0
+		self.cycles[:] = 0
+		self.halted[:] = False
+		self.running[:] = True
+		self.fetch[:] = True
+		self.instructions[:] = 0
+
+		ops = np.flatnonzero(~self.empty[:0x100]).astype(np.uint8)
+		threshold = int(fill * 0x100) if len(ops) else 0		# fill as a uint8 comparison
+		for row in self.ram:
+			row[:] = rnd.integers(0, 0x100, sim.RAM_BYTES, dtype = np.uint8)
+			if threshold >= 0x100:
+				m = slice(None)
+			elif threshold:
+				m = rnd.integers(0, 0x100, sim.RAM_BYTES, dtype = np.uint8) < threshold
+			else:
+				continue																# <-------
+			row[m] = ops[rnd.integers(0, len(ops), sim.RAM_BYTES, dtype = np.uint8)[m]]
+
+		return
+
+	#
+	#	Copy instance i's state into a sim.CPU
+	#
+	def toCPU(self, i, cpu):
+
+		r = cpu.reg
+		for name in REGISTERS:
+			setattr(r, name, int(getattr(self, name)[i]))
+		r.halted = bool(self.halted[i])
+		cpu.ram[:] = self.ram[i].tobytes()
+		cpu.flushBlocks()
+
+		return
+
+	#
+	#	Fetch & decode for instances at an instruction start, halting those on an opcode
+	#	with no microcode & stopping those out of cycles
+	#
+	def decode(self, maxCycles):
+
+		i = np.flatnonzero(self.fetch & self.running)
+		if not len(i):
+			return																			# ------>
+
+		op = self.flat[self.base[i] + self.pc[i]].astype(np.int64)
+
+		out = self.cycles[i] >= maxCycles
+		halt = self.empty[op] & ~out
+		self.halted[i[halt]] = True
+		self.running[i[out | halt]] = False
+
+		go = ~(out | halt)
+		i, op = i[go], op[go]
+		self.bus[i] = op
+		self.pc[i] = self.pc[i] + 1 & 0xffff
+		mcp = op << 3 | (self.condition[op] & self.flags[i] != 0) << 2
+		self.mcp[i] = mcp
+		self.cycles[i] += self.timing[mcp]
+		self.instructions[i] += 1
+		self.fetch[i] = False
+
+		return
+
+	#
+	#	One microcode word on every running instance, False once none are running
+	#
+	def step(self, maxCycles):
+
+		self.decode(maxCycles)
+		if not self.running.any():
+			return False																# ------>
+
+		mc = np.where(self.running, self.words[self.mcp & 0x7ff], 0)	# nop when stopped
+		flat = self.flat
+		base = self.base
+		bus = self.bus
+
+		#	Rising edge, memory read, source, pre decrement, flags, alu
+		#
+		field = mc >> 26 & 3
+		for k in present(field):
+			i = np.flatnonzero(field == k)
+			a = self.addr[i]
+			if k == 1:																	# word
+				bus[i] = flat[base[i] + a].astype(np.int64) | flat[base[i] + (a + 1 & 0xffff)].astype(np.int64) << 8
+			elif k == 2:																# byte
+				bus[i] = flat[base[i] + a]
+			else:																				# address register
+				bus[i] = a
+
+		field = mc >> 22 & 15
+		for k in present(field):
+			i = np.flatnonzero(field == k)
+			name = SOURCE_NAMES[k]
+			if name == "ws":
+				w = self.w[i]
+				bus[i] = (w & 0xff) << 8 | w >> 8
+			elif name:
+				bus[i] = getattr(self, name)[i]
+
+		counter = mc >> 15 & 7
+		self.sp = np.where(counter == 1, self.sp - 2 & 0xffff, self.sp)
+		self.rsp = np.where(counter == 3, self.rsp - 2 & 0xffff, self.rsp)
+
+		mask = mc >> 7 & 0x3f
+		self.flags = np.where(mc & sim.MC_FLAG_SET != 0, self.flags | mask, self.flags)
+		self.flags = np.where(mc & sim.MC_FLAG_CLEAR != 0, self.flags & ~mask, self.flags)
+
+		field = mc >> 3 & 15
+		for k in present(field):
+			i = np.flatnonzero(field == k)
+			x, c, v = ALU_EVAL[k]
+			env = {"alu1": self.alu1[i], "alu2": self.alu2[i], "flags": self.flags[i]}
+			env["x"] = eval(x, env)
+			alur = env["x"] & 0xffff
+			self.alur[i] = alur
+			self.flags[i] = (self.flags[i] & ~15 | alur >> 12 & 8 | (alur == 0).astype(np.int64) << 1
+				| np.asarray(eval(c, env)).astype(np.int64) | np.asarray(eval(v, env)).astype(np.int64))
+
+		#	Falling edge, memory write, destination, post increment
+		#
+		field = mc >> 28 & 3
+		for k in present(field):
+			i = np.flatnonzero(field == k)
+			a = self.addr[i]
+			if k == 1:																	# word, wraps at $ffff
+				flat[base[i] + a] = bus[i] & 0xff
+				flat[base[i] + (a + 1 & 0xffff)] = bus[i] >> 8
+			elif k == 2:																# byte
+				flat[base[i] + a] = bus[i] & 0xff
+			else:																				# address register
+				self.addr[i] = bus[i]
+
+		field = mc >> 18 & 15
+		for k in present(field):
+			i = np.flatnonzero(field == k)
+			name = DEST_NAMES[k]
+			if name == "flags":
+				self.flags[i] = bus[i] & 0xff
+			elif name:
+				getattr(self, name)[i] = bus[i]
+
+		self.sp = np.where(counter == 2, self.sp + 2 & 0xffff, self.sp)
+		self.rsp = np.where(counter == 4, self.rsp + 2 & 0xffff, self.rsp)
+		self.pc = np.where(counter == 5, self.pc + 1 & 0xffff, np.where(counter == 6, self.pc + 2 & 0xffff, self.pc))
+
+		#	Next word, or the next instruction after the end or the end of the slot
+		#
+		end = (mc & sim.MC_END != 0) | (self.mcp + 1 & 7 == 0)
+		self.mcp = np.where(self.running, self.mcp + 1, self.mcp)
+		self.fetch |= end & self.running
+
+		return True
+
+	#
+	#	Run every instance until halted or out of cycles, returns the steps taken
+	#
+	def run(self, maxCycles):
+
+		steps = 0
+		while self.step(maxCycles):
+			steps += 1
+
+		return steps
+
+
+#
+#	Instance i's registers & ram against a sim.CPU's, [differences]
+#
+def differences(ls, i, cpu):
+
+	out = []
+	for name in REGISTERS:
+		v, ref = int(getattr(ls, name)[i]), getattr(cpu.reg, name)
+		if v != ref:
+			out.append("{} ${:04x} interpreter ${:04x}".format(name, v, ref))
+	if bool(ls.halted[i]) != cpu.reg.halted:
+		out.append("halted {} interpreter {}".format(bool(ls.halted[i]), cpu.reg.halted))
+
+	ram = np.frombuffer(bytes(cpu.ram), dtype = np.uint8)
+	for a in np.flatnonzero(ls.ram[i] != ram)[:4]:
+		out.append("ram ${:04x} ${:02x} interpreter ${:02x}".format(a, ls.ram[i, a], ram[a]))
+
+	return out
+
+
+#
+#	lockstep.py [--microcode name] [-n instances] [--cycles n] [--seed n] [--fill f] [--check n]
+#
+def main(argv = None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description = "Lockstep numpy simulation of many instances")
+	parser.add_argument("--microcode", default = "microcode.obj", help = "microcode .obj or .bin")
+	parser.add_argument("-n", "--instances", type = int, default = 1000, help = "instances, 64K ram each")
+	parser.add_argument("--cycles", type = int, default = 1000, help = "cycle budget per instance")
+	parser.add_argument("--seed", type = int, default = 0, help = "random state seed")
+	parser.add_argument("--fill", type = float, default = 0.9, help = "fraction of ram bytes that are opcodes")
+	parser.add_argument("--check", type = int, default = 0, metavar = "N",
+											help = "compare the first N instances with the interpreter")
+	args = parser.parse_args(argv)
+
+	cpu = sim.CPU()
+	cpu.loadMicrocode(args.microcode)
+
+	ls = Lockstep(cpu, args.instances)
+	ls.randomize(args.seed, args.fill)
+
+	check = min(args.check, args.instances)
+	starts = []
+	for i in range(check):															# starting states
+		c = sim.CPU()
+		c.loadMicrocode(args.microcode)
+		ls.toCPU(i, c)
+		starts.append(c)
+
+	t = time.perf_counter()
+	steps = ls.run(args.cycles)
+	t = time.perf_counter() - t
+
+	cycles = int(ls.cycles.sum())
+	print("{} instances, {} steps, {} instructions, {} cycles, {} halted, {:.0f} instance cycles/sec".format(
+		args.instances, steps, int(ls.instructions.sum()), cycles, int(ls.halted.sum()), cycles / t if t else 0))
+
+	failed = 0
+	for i, c in enumerate(starts):
+		c.run(args.cycles, sim.MODE_INTERPRET)
+		diff = differences(ls, i, c)
+		if diff:
+			failed += 1
+			print("instance {}: {}".format(i, ", ".join(diff)))
+	if check:
+		print("{} of {} checked instances differ from the interpreter".format(failed, check))
+
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -6,270 +6,1627 @@ R.Lincoln		February 2024
 
 Simulate the processor at execution of microcode level
 
+	sim.py program.obj [--microcode microcode.obj] [--pc start] [--cycles n] [--mode blocks]
+	sim.py --restore snapshot.snap [--cycles n] [--save snapshot.snap]
+	sim.py program.obj --profile profile.json
+	sim.py program.obj [--until pc] [--break pc]... [--watch addr]... [--trace n]
+	sim.py program.obj --io [--input file] [--disk file]
+
+i.e.
+	cpu = sim.CPU()
+	cpu.loadMicrocode("microcode.obj")
+	symbols = cpu.loadProgram("test.obj")
+	cpu.reset(symbols["start"])
+	cpu.run(1000000)										-> instructions, cpu.reg.pc etc
+
+Each CPU holds its own registers, ram, microcode & the code built from it, so any number
+can exist in one process.
+
+Each 32 bit control word is decoded once, when microcode is loaded, into a pair of
+tuples of field handlers: rising edge device => bus, falling edge bus => device.
+Handlers come from dispatch tables indexed by each field's value, nop fields have
+none, closures on their CPU's registers & ram.  The handler pairs from every microcode
+address up to its instruction's end are cached, so an instruction runs as one loop
+over prepared calls.
+
+Control word fields, see microcode.asm
+	31				end, the last cycle of the instruction
+	30				fetch, the next opcode fetch overlaps this instruction
+	28-29			memory write		word, byte or bus -> address register
+	26-27			memory read			word, byte or address register -> bus
+	22-25			source register -> bus
+	18-21			bus -> destination register
+	15-17			counters				sp-2 & rsp-2 before, sp+2 rsp+2 pc+1 pc+2 after
+	7-14			flags						set, clear & i b n v z c select
+	3-6				alu operation		alu1 op alu2 -> alur
+
+Each opcode is also compiled to one python function from its microcode, see
+compileMicrocode, and by default runs of them up to a branch are translated into one
+function per basic block, cached by PC, see translate.  --mode compiled runs the
+instruction functions alone, --mode interpret steps the microcode handlers as the
+reference.
+
+Conditional instructions select flags in their first word without set or clear,
+when any selected flag is set the flag set variant 4 words on runs instead.
+An opcode with no microcode halts the simulation.
+
+A Profile set on a CPU counts cycles per opcode, microcode address & guest label range,
+see Profile.
+
+Runs stop at a cycle budget, an until PC, breakpoints or watchpoints, with an optional
+ring buffer trace of the last instructions, see CPU.run.
+
+The whole machine can be snapshot & restored, in memory with copy on write pages or to
+a memory mappable file, see snapshot.
+
+Devices attached to a CPU claim address ranges, console, timer & block storage in
+devices.py, see attach.
+
 """
 
-#	32 bit wide microcode memory
-#
-microcode = [
-]
+import re
+import sys
+import bisect
+import time
+import array
+import mmap
+import struct
+import loader
+
+
+MC_WORDS	= 2048																# 2k x 32 bits
+RAM_BYTES	= 0x10000															# 64k x 8 bits
 
-#	8 bit wide ram
+#	16 bit little endian words at any ram address
 #
-ram = [
-]
-rAddr = 0
+WORD = struct.Struct("<H")
+wordAt = WORD.unpack_from
+wordTo = WORD.pack_into
 
 
-#	Registers
 #
-rA = 0
-rB = 0
-rX = 0
-rY = 0
+#	Register file
+#
+class Registers:
+
+	__slots__ = (
+		"a", "b",																		# registers
+		"t", "n", "r", "o",
+		"sp", "rsp",
+
+		"pc", "w",																	# internal implicitly accessed registers
+		"flags",
+		"alu1", "alu2", "alur",
+		"addr",																			# memory address register
+		"mcp",																			# microcode pointer
+		"bus",																			# the data bus, holds its value between cycles
+
+		"cycles",																		# simulation state
+		"halted"
+	)
+
+	def __init__(self, pc = 0):
+		self.reset(pc)
+
+	#	Registers to zero, start at an address
+	#
+	def reset(self, pc = 0):
+		self.a = self.b = self.t = self.n = self.r = self.o = self.sp = self.rsp = 0
+		self.w = self.flags = self.alu1 = self.alu2 = self.alur = 0
+		self.addr = self.mcp = self.bus = self.cycles = 0
+		self.pc = pc
+		self.halted = False
+
+
+#	Flags register bits, as the flag select bits of the control word
+#
+FLAG_I = 0x20																			# interrupt mask
+FLAG_B = 0x10																			# byte/word mode
+FLAG_N = 0x08																			# negative
+FLAG_V = 0x04																			# overflow
+FLAG_Z = 0x02																			# zero
+FLAG_C = 0x01																			# carry
 
-rT = 0
-rR = 0
-rO = 0
+MC_END				= 1 << 31
+MC_FETCH			= 1 << 30
+MC_FLAG_SET		= 1 << 14
+MC_FLAG_CLEAR	= 1 << 13
 
-rSP = 0
-rRSP = 0
 
-# Internal implicitly accessed registers
 #
-rPC = 0
-rW = 0
+#	Interpreter field handlers, closures on one CPU's registers & ram
+#	Returns the dispatch tables indexed by each field's value & the flag handler factory
+#
+def handlers(cpu):
+
+	reg = cpu.reg
+	ram = cpu.ram
+	writeTraps = cpu.writeTraps
+	writeTrap = cpu.writeTrap
+	ioPages = cpu.ioPages
+	ioByte = cpu.ioByte
+	ioWord = cpu.ioWord
+
+	#
+	#	Memory read, rising edge	Device => Bus
+	#	With devices attached reads check the page table, else straight from ram
+	#
+	def memWordR():
+		a = reg.addr
+		reg.bus = wordAt(ram, a)[0] if a != 0xffff else ram[a] | ram[0] << 8
+
+	def memByteR():
+		reg.bus = ram[reg.addr]
+
+	def ioWordR():
+		a = reg.addr
+		if ioPages[a >> 8] or ioPages[a + 1 >> 8 & 0xff]:
+			reg.bus = ioWord(a)
+		else:
+			reg.bus = wordAt(ram, a)[0] if a != 0xffff else ram[a] | ram[0] << 8
+
+	def ioByteR():
+		a = reg.addr
+		reg.bus = ioByte(a) if ioPages[a >> 8] else ram[a]
+
+	def memAddrR():
+		reg.bus = reg.addr
+
+	if cpu.devices:
+		MEM_READ = (None, ioWordR, ioByteR, memAddrR)
+	else:
+		MEM_READ = (None, memWordR, memByteR, memAddrR)
+
+	#
+	#	Memory write, falling edge	Device <= Bus
+	#
+	def memWordW():
+		a = reg.addr
+		if a != 0xffff:
+			wordTo(ram, a, reg.bus)
+		else:																					# wraps
+			ram[a] = reg.bus & 0xff
+			ram[0] = reg.bus >> 8
+		if writeTraps[a] or writeTraps[a + 1 & 0xffff]:	# ? over translated code, watched or a device
+			writeTrap(a, 2)
+
+	def memByteW():
+		a = reg.addr
+		ram[a] = reg.bus & 0xff
+		if writeTraps[a]:
+			writeTrap(a, 1)
+
+	def memAddrW():
+		reg.addr = reg.bus
+
+	MEM_WRITE = (None, memWordW, memByteW, memAddrW)
+
+	#
+	#	Source register => Bus
+	#
+	def srcA():			reg.bus = reg.a
+	def srcB():			reg.bus = reg.b
+	def srcT():			reg.bus = reg.t
+	def srcR():			reg.bus = reg.r
+	def srcO():			reg.bus = reg.o
+	def srcPC():		reg.bus = reg.pc
+	def srcSP():		reg.bus = reg.sp
+	def srcRSP():		reg.bus = reg.rsp
+	def srcALU():		reg.bus = reg.alur
+	def srcFlags():	reg.bus = reg.flags
+	def srcWS():		reg.bus = (reg.w & 0xff) << 8 | reg.w >> 8
+	def srcW():			reg.bus = reg.w
+	def srcN():			reg.bus = reg.n
+
+	SOURCE = (None, srcA, srcB, srcT, srcR, srcO, srcPC, srcSP, srcRSP, srcALU, None, srcFlags, None, srcWS, srcW, srcN)
+
+	#
+	#	Bus => destination register
+	#
+	def dstA():			reg.a = reg.bus
+	def dstB():			reg.b = reg.bus
+	def dstT():			reg.t = reg.bus
+	def dstR():			reg.r = reg.bus
+	def dstO():			reg.o = reg.bus
+	def dstPC():		reg.pc = reg.bus
+	def dstSP():		reg.sp = reg.bus
+	def dstRSP():		reg.rsp = reg.bus
+	def dstALU1():	reg.alu1 = reg.bus
+	def dstALU2():	reg.alu2 = reg.bus
+	def dstFlags():	reg.flags = reg.bus & 0xff
+	def dstW():			reg.w = reg.bus
+	def dstN():			reg.n = reg.bus
+
+	DEST = (None, dstA, dstB, dstT, dstR, dstO, dstPC, dstSP, dstRSP, dstALU1, dstALU2, dstFlags, None, None, dstW, dstN)
+
+	#
+	#	Counters, pre decrement on the rising edge, post increment on the falling edge
+	#
+	def spMinus2():		reg.sp = reg.sp - 2 & 0xffff
+	def spPlus2():		reg.sp = reg.sp + 2 & 0xffff
+	def rspMinus2():	reg.rsp = reg.rsp - 2 & 0xffff
+	def rspPlus2():		reg.rsp = reg.rsp + 2 & 0xffff
+	def pcPlus1():		reg.pc = reg.pc + 1 & 0xffff
+	def pcPlus2():		reg.pc = reg.pc + 2 & 0xffff
+
+	COUNTER_PRE		= (None, spMinus2, None, rspMinus2, None, None, None, None)
+	COUNTER_POST	= (None, None, spPlus2, None, rspPlus2, pcPlus1, pcPlus2, None)
+
+	#
+	#	Flag set & clear handlers, one per flag selection
+	#
+	flagHandlers = {
+	}
+
+	def flagHandler(set, mask):
+
+		h = flagHandlers.get((set, mask))
+		if h is None:
+			if set:
+				def h():
+					reg.flags |= mask
+			else:
+				def h():
+					reg.flags &= ~mask
+			flagHandlers[(set, mask)] = h
+
+		return h
+
+	#
+	#	ALU, alu1 op alu2 -> alur setting n & z, c & v as the operation does
+	#
+	def aluFlags(r, c, v):
+
+		r &= 0xffff
+		reg.alur = r
+		f = reg.flags & ~(FLAG_N | FLAG_Z | FLAG_C | FLAG_V)
+		if r & 0x8000: f |= FLAG_N
+		if r == 0: f |= FLAG_Z
+		if c: f |= FLAG_C
+		if v: f |= FLAG_V
+		reg.flags = f
+
+	def aluAdd():																		# with carry
+		a, b = reg.alu1, reg.alu2
+		r = a + b + (reg.flags & FLAG_C)
+		aluFlags(r, r > 0xffff, ~(a ^ b) & (a ^ r) & 0x8000)
+
+	def aluSub():																		# with borrow, carry clear
+		a, b = reg.alu1, reg.alu2
+		r = a - b - (1 - (reg.flags & FLAG_C))
+		aluFlags(r, r >= 0, (a ^ b) & (a ^ r) & 0x8000)
+
+	def aluAnd():
+		aluFlags(reg.alu1 & reg.alu2, reg.flags & FLAG_C, reg.flags & FLAG_V)
+
+	def aluOr():
+		aluFlags(reg.alu1 | reg.alu2, reg.flags & FLAG_C, reg.flags & FLAG_V)
+
+	def aluXor():
+		aluFlags(reg.alu1 ^ reg.alu2, reg.flags & FLAG_C, reg.flags & FLAG_V)
+
+	def aluAsl():
+		aluFlags(reg.alu1 << 1, reg.alu1 & 0x8000, reg.flags & FLAG_V)
+
+	def aluAsr():
+		aluFlags(reg.alu1 >> 1 | reg.alu1 & 0x8000, reg.alu1 & 1, reg.flags & FLAG_V)
+
+	def aluLsr():
+		aluFlags(reg.alu1 >> 1, reg.alu1 & 1, reg.flags & FLAG_V)
+
+	def aluRol():
+		aluFlags(reg.alu1 << 1 | reg.flags & FLAG_C, reg.alu1 & 0x8000, reg.flags & FLAG_V)
+
+	def aluRor():
+		aluFlags(reg.alu1 >> 1 | (reg.flags & FLAG_C) << 15, reg.alu1 & 1, reg.flags & FLAG_V)
+
+	def aluPlus1():
+		aluFlags(reg.alu1 + 1, reg.flags & FLAG_C, reg.flags & FLAG_V)
+
+	def aluPlus2():
+		aluFlags(reg.alu1 + 2, reg.flags & FLAG_C, reg.flags & FLAG_V)
+
+	def aluMinus1():
+		aluFlags(reg.alu1 - 1, reg.flags & FLAG_C, reg.flags & FLAG_V)
+
+	def aluMinus2():
+		aluFlags(reg.alu1 - 2, reg.flags & FLAG_C, reg.flags & FLAG_V)
 
-rFlags = 0
+	ALU = (None, aluAdd, aluSub, aluAnd, aluOr, aluXor, aluAsl, aluAsr,
+				aluAsl, aluLsr, aluRol, aluRor, aluPlus1, aluPlus2, aluMinus1, aluMinus2)		# lsl is asl
 
-rALU1 = 0
-rALU2 = 0
-rALUR = 0
+	return MEM_READ, MEM_WRITE, SOURCE, DEST, COUNTER_PRE, COUNTER_POST, ALU, flagHandler
 
-#	Microcode pointer
+
+#
+#	Microcode compiler
+#
+#	Each opcode's flag clear & flag set microcode sequences become one python function,
+#	fetch included, the control words' effects as statements on local registers in
+#	rising then falling edge order.  Registers used are loaded at the start, those changed
+#	stored at the end with the microcode pointer & cycle count, as the interpreter leaves them.
+#
+#		compiled[opcode]			(flag clear function, flag set function) or None if empty
+#		compiledText[opcode]	(flag clear source, flag set source)
 #
-rMCP = 0
+#	Statements for each field value, as the interpreter handlers
+#
+SRC_CODE = (None, "bus = a", "bus = b", "bus = t", "bus = r", "bus = o", "bus = pc", "bus = sp",
+	"bus = rsp", "bus = alur", None, "bus = flags", None, "bus = (w & 0xff) << 8 | w >> 8", "bus = w", "bus = n")
+
+DST_CODE = (None, "a = bus", "b = bus", "t = bus", "r = bus", "o = bus", "pc = bus", "sp = bus",
+	"rsp = bus", "alu1 = bus", "alu2 = bus", "flags = bus & 0xff", None, None, "w = bus", "n = bus")
+
+MEM_READ_CODE = (None, "bus = wordAt(ram, addr)[0] if addr != 0xffff else ram[addr] | ram[0] << 8",
+	"bus = ram[addr]", "bus = addr")
+
+MEM_READ_IO_CODE = (None, "bus = ioWord(addr) if ioPages[addr >> 8] or ioPages[addr + 1 >> 8 & 0xff] "
+	"else wordAt(ram, addr)[0] if addr != 0xffff else ram[addr] | ram[0] << 8",
+	"bus = ioByte(addr) if ioPages[addr >> 8] else ram[addr]", "bus = addr")
 
-#	The data bus
-BUS = 0
+MEM_WRITE_CODE = ((),
+	("wordTo(ram, addr, bus) if addr != 0xffff else wrapWord(ram, bus)",
+		"if writeTraps[addr] or writeTraps[addr + 1 & 0xffff]: writeTrap(addr, 2)"),
+	("ram[addr] = bus & 0xff",
+		"if writeTraps[addr]: writeTrap(addr, 1)"),
+	("addr = bus",))
 
+COUNTER_PRE_CODE		= (None, "sp = sp - 2 & 0xffff", None, "rsp = rsp - 2 & 0xffff", None, None, None, None)
+COUNTER_POST_CODE		= (None, None, "sp = sp + 2 & 0xffff", None, "rsp = rsp + 2 & 0xffff",
+	"pc = pc + 1 & 0xffff", "pc = pc + 2 & 0xffff", None)
 
-#	Initialise ram etc
+#	ALU result x, then carry & overflow as flag bit values, as aluFlags
 #
-def init():
-	for i in range(0, 2048):				# 2k x 32 bits
-		microcode.append(0x00000000)
+ALU_KEEP_C = "flags & 1"
+ALU_KEEP_V = "flags & 4"
+ALU_CODE = (
+	None,
+	("alu1 + alu2 + (flags & 1)", "(x > 0xffff)", "(~(alu1 ^ alu2) & (alu1 ^ x) & 0x8000) >> 13"),
+	("alu1 - alu2 - (1 - (flags & 1))", "(x >= 0)", "((alu1 ^ alu2) & (alu1 ^ x) & 0x8000) >> 13"),
+	("alu1 & alu2", ALU_KEEP_C, ALU_KEEP_V),
+	("alu1 | alu2", ALU_KEEP_C, ALU_KEEP_V),
+	("alu1 ^ alu2", ALU_KEEP_C, ALU_KEEP_V),
+	("alu1 << 1", "alu1 >> 15", ALU_KEEP_V),
+	("alu1 >> 1 | alu1 & 0x8000", "alu1 & 1", ALU_KEEP_V),
+	("alu1 << 1", "alu1 >> 15", ALU_KEEP_V),
+	("alu1 >> 1", "alu1 & 1", ALU_KEEP_V),
+	("alu1 << 1 | flags & 1", "alu1 >> 15", ALU_KEEP_V),
+	("alu1 >> 1 | (flags & 1) << 15", "alu1 & 1", ALU_KEEP_V),
+	("alu1 + 1", ALU_KEEP_C, ALU_KEEP_V),
+	("alu1 + 2", ALU_KEEP_C, ALU_KEEP_V),
+	("alu1 - 1", ALU_KEEP_C, ALU_KEEP_V),
+	("alu1 - 2", ALU_KEEP_C, ALU_KEEP_V),
+)
+
+REGISTERS = ("a", "b", "t", "n", "r", "o", "sp", "rsp", "pc", "w", "flags", "alu1", "alu2", "alur",
+	"addr", "bus", "mcp", "cycles")
+
+LEX_ASSIGN = re.compile(r"^(\w+) [|&+]?=")
+LEX_NAME = re.compile(r"\b\w+\b")
+
+codeCache = {																			# source -> code object, shared by every CPU
+}																									# least recently used first
+CODE_CACHE_MAX = 1024																# entries, about 7K each
+
+
+def wrapWord(ram, bus):																# word write at $ffff
+	ram[0xffff] = bus & 0xff
+	ram[0] = bus >> 8
 
-	for i in range(0, 65536):				# 64k x 8 bits
-		ram.append(0x00)
 
-	rPC = 0
+#
+#	Python function source from statements on the registers
+#	Registers read before they're assigned are loaded first, any assigned are stored last.
+#	Statements in if/else blocks load every register they name, a return in one stores
+#	the registers first so every assigned register is loaded, its value if any returned.
+#
+def functionText(name, body):
+
+	read = set()
+	assigned = set()
+	for line in body:
+		if line[0] == "#":
+			continue																		# <-------
+		m = LEX_ASSIGN.match(line)
+		if line[0] == "	" or line[-1] == ":":								# ? conditional, load anything named
+			read.update(LEX_NAME.findall(line))
+			m = LEX_ASSIGN.match(line.strip())
+		elif m and m.group(0)[-2] == " ":						# ? plain =, target not read
+			read.update(n for n in LEX_NAME.findall(line[m.end():]) if n not in assigned)
+		else:
+			read.update(n for n in LEX_NAME.findall(line) if n not in assigned)
+		if m:
+			assigned.add(m.group(1))
+
+	store = ["reg.{} = {}".format(r, r) for r in REGISTERS if r in assigned]
+	if any(line.startswith("	return") for line in body):		# ? early exit
+		read |= assigned
+
+	text = "def {}(reg, ram):\n".format(name)
+	text += "".join("	{} = reg.{}\n".format(r, r) for r in REGISTERS if r in read)
+	for line in body:
+		if line.startswith("	return"):
+			text += "".join("		{}\n".format(s) for s in store)
+		text += "	{}\n".format(line)
+	text += "".join("	{}\n".format(s) for s in store)
+
+	return text
 
-	return
 
 #
-#	Return the instruction at the PC
+#	Compile python source, returning the function it defines with g as its globals
+#	Code is cached by source, the least recently used dropped past CODE_CACHE_MAX, so
+#	instructions & blocks built again, eg. after self modifying code, aren't recompiled
 #
-def fetch():
-	global BUS, rPC
+def compileFunction(text, name, file, g):
 
-	BUS = ram[rPC]
-	rPC += 1
+	code = codeCache.pop(text, None)
+	if code is None:
+		code = compile(text, file, "exec")
+		if len(codeCache) >= CODE_CACHE_MAX:
+			del codeCache[next(iter(codeCache))]
+	codeCache[text] = code														# most recently used last
 
-	print(rPC)
-	return
+	g.update(wordAt = wordAt, wordTo = wordTo, wrapWord = wrapWord)
+	exec(code, g)
 
+	return g[name]
 
+
+#
+#	Translated basic blocks
+#
+#	Straight line guest code from a PC up to & including the first instruction that can
+#	change the PC from the bus or is conditional, jmp jsr rts beq bne etc, or an opcode
+#	with no microcode, becomes one python function on local registers.  The opcodes are
+#	the only guest bytes built in, operands are read from ram as the microcode does, so a
+#	write to a translated opcode's address drops every block holding it.  A block writing
+#	over its own opcodes returns after that instruction with the count it ran, the next
+#	entry translates again.
+#
+#	Blocks run whole, so a run can end up to a block past its cycle budget.
 #
-#	Generate the MCPC from the opcode on the bus
+#		blocks						PC -> Block
+#		writeTraps[addr]	TRAP_CODE where a translated opcode is, TRAP_WATCH if watched,
+#											TRAP_DEVICE if claimed by a device
+#		owners						opcode address -> [Block...]
+#		branches[opcode]	True if the instruction ends a block
+#		steps[opcode]			PC increment of the others
 #
-def decode():
-	global rMCP, BUS, rFlags
+#	Memory writes check writeTraps, one byte lookup, before calling writeTrap
+#
+BLOCK_MAX = 64																		# instructions per block
 
-	rMCP = BUS << 3												# 3 bits for microcode line
+TRAP_CODE		= 1
+TRAP_WATCH	= 2
+TRAP_DEVICE	= 4
+TRAP_CLEAR_CODE = bytes(i & ~TRAP_CODE for i in range(256))		# translate table
 
-	mc = microcode[rMCP]
-	f = mc_flag_i or mc_flag_b or mc_flag_n or mc_flag_v or mc_flag_z or mc_flag_c
+class Block:
 
-	if mc & f:														# ? selected in the instruction
-		if rFlags | f:											# ? set in the flags register
-			rMCP |= 4													# => set in the counter
+	__slots__ = ("fn", "start", "ops", "count", "valid", "exits", "text")
 
-	return
+	def __init__(self, fn, start, ops, text):
+		self.fn = fn
+		self.start = start
+		self.ops = ops																# opcode addresses
+		self.count = len(ops)
+		self.valid = True
+		self.exits = {}																# chained next blocks, PC -> Block
+		self.text = text
 
 
 #
-#	Sequence through microcode from MCPC
-#	write to the bus on rising edge
-#	read from the bus on falling edge
+#	Profile of the guest, set as cpu.profile before a run to collect one
 #
-def execute():
-	global rMCP
-
-	while True:
-		mc = microcode[rMCP]								# next microcode line
-		rMCP += 1
-
-		if mc & mc_end:
-			break															# --->
+#	Counts executed instructions & cycles per opcode, entries to each microcode sequence,
+#	expanded to hits on every one of the 2K microcode addresses, and instructions & cycles
+#	per guest PC, summed into ranges from each label to the next.
+#
+#	A profiled run goes instruction by instruction, compiled or interpreted, blocks can't
+#	be counted inside.  With no profile the run loops are untouched.
+#
+#		ops[opcode]				instructions
+#		opCycles[opcode]	cycles
+#		starts[address]		microcode sequence entries, opcode << 3 or | 4 for flag set
+#		pcs[pc]						instructions
+#		pcCycles[pc]			cycles
+#
+class Profile:
+
+	def __init__(self):
+		self.ops = [0] * (MC_WORDS >> 3)
+		self.opCycles = [0] * (MC_WORDS >> 3)
+		self.starts = [0] * MC_WORDS
+		self.pcs = [0] * RAM_BYTES
+		self.pcCycles = [0] * RAM_BYTES
+
+	#	Hits on each microcode address, a sequence's entries count on every word it runs
+	#
+	def microcodeHits(self, cpu):
+
+		hits = [0] * MC_WORDS
+		for addr, n in enumerate(self.starts):
+			if n:
+				for a in range(addr, addr + len(cpu.sequences[addr])):
+					hits[a] += n
+
+		return hits
+
+	#	[(label, start, end, instructions, cycles)] of the PCs run, by cycles, most first
+	#	Each range is from a label to the next, "$xxxx" for code before the first label
+	#
+	def ranges(self, symbols = None):
+
+		labels = sorted((v, l) for l, v in (symbols or {}).items() if 0 <= v < RAM_BYTES)
+		values = [v for v, l in labels]
+
+		out = {}
+		for pc, n in enumerate(self.pcs):
+			if not n:
+				continue																	# <-------
+			i = bisect.bisect_right(values, pc) -1
+			if i < 0:
+				key = ("${:04x}".format(0), 0, (values[0] if values else RAM_BYTES) -1)
+			else:
+				key = (labels[i][1], values[i], (values[i + 1] if i + 1 < len(values) else RAM_BYTES) -1)
+			c = out.get(key, (0, 0))
+			out[key] = (c[0] + n, c[1] + self.pcCycles[pc])
+
+		return sorted((k + v for k, v in out.items()), key = lambda r: (-r[4], r[1]))
+
+	#	Raw counts for a file, to diff between microcode revisions
+	#
+	def data(self, cpu, symbols = None):
+
+		return {
+			"instructions":	sum(self.ops),
+			"cycles":				sum(self.opCycles),
+			"opcodes":			{"${:02x}".format(op): {"name": cpu.opNames.get(op, ""), "count": n, "cycles": self.opCycles[op]}
+												for op, n in enumerate(self.ops) if n},
+			"microcode":		self.microcodeHits(cpu),
+			"ranges":				[{"label": l, "start": s, "end": e, "count": n, "cycles": c}
+												for l, s, e, n, c in self.ranges(symbols)],
+		}
+
+	#	Report text, opcodes, microcode lines & guest ranges sorted by cycles or hits
+	#
+	def report(self, cpu, symbols = None, top = 20):
+
+		instructions = sum(self.ops)
+		cycles = sum(self.opCycles) or 1
+
+		lines = ["{} instructions, {} cycles".format(instructions, sum(self.opCycles)), "",
+			"opcode  name          count       cycles   cycle%   cpi"]
+		for op in sorted((op for op, n in enumerate(self.ops) if n), key = lambda op: -self.opCycles[op]):
+			n, c = self.ops[op], self.opCycles[op]
+			lines.append("${:02x}     {:10} {:>8} {:>12} {:>7.1%} {:>5.2f}".format(
+				op, cpu.opNames.get(op, ""), n, c, c / cycles, c / n))
+
+		hits = self.microcodeHits(cpu)
+		lines += ["", "microcode        hits"]
+		for a in sorted((a for a, n in enumerate(hits) if n), key = lambda a: (-hits[a], a))[:top]:
+			lines.append("${:03x} {:10} {:>8}".format(a, cpu.opNames.get(a >> 3, ""), hits[a]))
+
+		lines += ["", "label              range          count       cycles   cycle%"]
+		for l, s, e, n, c in self.ranges(symbols)[:top]:
+			lines.append("{:18} ${:04x}-${:04x} {:>8} {:>12} {:>7.1%}".format(l, s, e, n, c, c / cycles))
+
+		return "\n".join(lines) + "\n"
 
-		execRising(mc)											# clock rising edge
-		execFalling(mc)											# clock falling edge
 
-	return
+#
+#	Ring buffer of the last instructions run, set as cpu.trace before a run
+#	Preallocated arrays, so a long run's memory stays flat
+#
+#		pcs, ops, cycles			per entry, the PC, opcode & cycle count before it ran
+#		regs									TRACE_REGISTERS per entry, before it ran
+#
+TRACE_REGISTERS = ("a", "b", "t", "n", "r", "o", "sp", "rsp", "w", "flags")
+TRACE_WIDTH = len(TRACE_REGISTERS)
+
+class Trace:
+
+	def __init__(self, size = 1024):
+		self.size = size
+		self.pcs = array.array("H", bytes(2 * size))
+		self.ops = array.array("B", bytes(size))
+		self.cycles = array.array("Q", bytes(8 * size))
+		self.regs = array.array("H", bytes(2 * size * TRACE_WIDTH))
+		self.next = 0																	# slot to write
+		self.count = 0																# entries held
+
+	def record(self, pc, op, r):
+		i = self.next
+		self.pcs[i] = pc
+		self.ops[i] = op
+		self.cycles[i] = r.cycles
+		g = self.regs
+		j = i * TRACE_WIDTH
+		g[j], g[j + 1], g[j + 2], g[j + 3], g[j + 4], g[j + 5], g[j + 6], g[j + 7], g[j + 8], g[j + 9] = \
+			r.a, r.b, r.t, r.n, r.r, r.o, r.sp, r.rsp, r.w, r.flags
+		self.next = 0 if i + 1 == self.size else i + 1
+		if self.count < self.size:
+			self.count += 1
+
+	#	[(pc, opcode, cycles, {register: value})] oldest first
+	#
+	def entries(self):
+
+		out = []
+		k = TRACE_WIDTH
+		for n in range(self.count):
+			i = (self.next - self.count + n) % self.size
+			out.append((self.pcs[i], self.ops[i], self.cycles[i],
+				dict(zip(TRACE_REGISTERS, self.regs[i * k:i * k + k]))))
+
+		return out
+
+	#	One line per entry, oldest first
+	#
+	def text(self, names = None):
+
+		names = names or {}
+		return "".join("${:04x} {:8} {:>10}  {}\n".format(pc, names.get(op, "${:02x}".format(op)), c,
+			" ".join("{} ${:04x}".format(k, v) for k, v in regs.items()))
+			for pc, op, c, regs in self.entries())
 
 
 #
-#	Rising edge read from devices to the bus and/or start activity
-#	Device => Bus
-#
-def execRising(mc):
-	global BUS, rAddr, rA, rB, rX, rY
-
-	if mc & mc_fetch:										# prefetch
-		rAddr = rPC												# models a direct PC to Addr path
-
-	if mc & mc_word_r:									# RAM
-		BUS = ram[rAddr] + ram[rAddr +1] << 8
-	if mc & mc_byte_r:
-		BUS = ram[rAddr]
-	if mc & mc_addr_r:
-		BUS = rAddr
-
-	if mc & mc_a_r:	BUS = rA						# registers
-	if mc & mc_b_r:	BUS = rB
-	if mc & mc_x_r:	BUS = rX
-	if mc & mc_y_r:	BUS = rY
-
-	if mc & mc_t_r:	BUS = rT
-	if mc & mc_n_r:	BUS = rN
-	if mc & mc_r_r:	BUS = rR
-	if mc & mc_o_r:	BUS = rO
-
-	if mc & mc_sp_r:	BUS = rSP
-	if mc & mc_rsp_r:	BUS = rRSP
-
-	if mc & mc_pc_r:	BUS = rPC
-	if mc & mc_w_r:		BUS = rW
-	if mc & mc_ws_r:	BUS = (rW & 255) << 8 | (rw >> 8)
-
-	if mc & mc_f_r:		BUS = rFlags
-
-	if mc & mc_alu1_r:	BUS = rALU1
-	if mc & mc_alu2_r:	BUS = rALU2
-	if mc & mc_alur_r:	BUS = rALUR
-
-	if mc & mc_sp_minus2:								# counters pre decrement
-		rSP -= 2
-	if mc & mc_rsp_minus2:
-		rRSP -= 2
-
-	if mc & mc_flag_set:								# flags
-		f = mc_flag_i or mc_flag_b or mc_flag_n or mc_flag_v or mc_flag_z or mc_flag_c
-		rFlags |= f
-	if mc & mc_flag_clear:
-		f = 0xff ^ (mc_flag_i or mc_flag_b or mc_flag_n or mc_flag_v or mc_flag_z or mc_flag_c)
-		rFlags &= f
-	if mc_flag_set == 0 & mc_flag_clear == 0:
-		BUS = mc_flag_i or mc_flag_b or mc_flag_n or mc_flag_v or mc_flag_z or mc_flag_c
-
-	if mc & mc_alu_add:									# ALU
-		rALUR = ALU1 + ALU2
-		if rALUR == 0:										# <-- factor out flag setting
-			rFlags |= zero
-		else
-			rFlags &= 0xff ^ zero
-		if rALUR > 0xffff:
-			rFlags |= carry
-		else
-			rFlags &= 0xff ^ carry
-
-		rFlags |= rALUR | 0x8000 | negative
-		rALUR &= 0xffff
-
-	if mc & mc_alu_sub:
-		rALUR = ALU1 - ALU2
-	if mc & mc_alu_and:
-		rALUR = ALU1 and ALU2
-	if mc & mc_alu_or:
-		rALUR = ALU1 or ALU2
-	if mc & mc_alu_xor:
-		rALUR = ALU1 ^ ALU2
-
-#asl
-#asr
-	if mc & mc_alu_inc:
-		ALU1 += 1
-	if mc & mc_alu_dec:
-		ALU1 -= 1
-#rol
-#ror
-#cmp
-	if mc & mc_alu_lsl:
-		ALU1 << 1
-	if mc & mc_alu_lsr:
-		ALU1 >> 1
+#	Run modes
+#		MODE_BLOCKS translated blocks, MODE_COMPILED one function per instruction,
+#		MODE_INTERPRET the microcode handlers
+#
+MODE_INTERPRET	= "interpret"
+MODE_COMPILED		= "compiled"
+MODE_BLOCKS			= "blocks"
+MODES = (MODE_BLOCKS, MODE_COMPILED, MODE_INTERPRET)
 
-	return
+#	Why a run stopped
+#
+STOP_HALTED	= "halted"															# opcode with no microcode
+STOP_CYCLES	= "budget used"
+STOP_BREAK	= "breakpoint"
+STOP_WATCH	= "watchpoint"
+STOP_UNTIL	= "until"
 
 
 #
-#	Falling edge - write to devices from the bus
-#	Device <= Bus
+#	One simulated processor, its registers, 8 bit ram & 32 bit microcode
 #
-def execFalling(mc):
+#	Decoded microcode
+#		sequences[address]		((rising, falling)...) to the instruction's end, in its slot
+#		timing[address]				cycles for the sequence, + 1 unless it fetches the next opcode
+#		condition[opcode]			flags selecting the flag set variant, 0 unconditional
+#		empty[opcode]					True for opcodes with no microcode
+#
+class CPU:
+
+	def __init__(self):
+		self.reg = Registers()
+		self.ram = bytearray(RAM_BYTES)												# 8 bit wide, replaced in place only
+		self.microcode = array.array("I", bytes(MC_WORDS * 4))	# 32 bit wide
+
+		self.sequences = []
+		self.timing = []
+		self.condition = []
+		self.empty = [True] * (MC_WORDS >> 3)
+		self.branches = []
+		self.steps = []
+
+		self.compiled = [None] * (MC_WORDS >> 3)
+		self.compiledText = [None] * (MC_WORDS >> 3)
+		self.opNames = {}																	# opcode -> mnemonic, from microcode labels
+
+		self.profile = None																# Profile to collect on runs
+
+		self.blocks = {}
+		self.owners = {}
+		self.writeTraps = bytearray(RAM_BYTES)
+
+		self.breakpoints = set()															# PCs, and as a bitmap
+		self.breakMap = bytearray(RAM_BYTES)
+		self.watchpoints = set()															# addresses, TRAP_WATCH in writeTraps
+		self.watchHit = None																# first watched address written
+		self.trace = None																	# Trace of recent instructions
+		self.stopped = None																# why the last run ended, STOP_...
+		self.stopAddr = None
+
+		self.devices = []																	# attached, see attach
+		self.ioMap = {}																		# claimed address -> device
+		self.ioPages = bytearray(RAM_BYTES >> 8)						# 1 for pages with a claimed address
+
+		self.decodedWords = {}																# control word -> handlers
+		(self.MEM_READ, self.MEM_WRITE, self.SOURCE, self.DEST,
+			self.COUNTER_PRE, self.COUNTER_POST, self.ALU, self.flagHandler) = handlers(self)
+
+	#	Clear ram & microcode, registers to zero
+	#
+	def init(self):
+
+		self.microcode[:] = array.array("I", bytes(MC_WORDS * 4))
+		self.ram[:] = bytes(RAM_BYTES)
+		self.decodeMicrocode()
+		self.compileMicrocode()
+		self.reset()
+
+		return
+
+	#	Registers to zero, start at an address
+	#
+	def reset(self, pc = 0):
+
+		self.reg.reset(pc)
+
+		return
+
+	#
+	#	Control word -> (rising handlers, falling handlers)
+	#
+	#	Rising		memory read, source, pre decrement, flags, alu
+	#	Falling		memory write, destination, post increment
+	#
+	def decodeWord(self, mc):
+
+		d = self.decodedWords.get(mc)
+		if d is not None:
+			return d																		# ------>
+
+		rising = [
+			self.MEM_READ[mc >> 26 & 3],
+			self.SOURCE[mc >> 22 & 15],
+			self.COUNTER_PRE[mc >> 15 & 7],
+		]
+		mask = mc >> 7 & 0x3f
+		if mc & MC_FLAG_SET and mask:
+			rising.append(self.flagHandler(True, mask))
+		if mc & MC_FLAG_CLEAR and mask:
+			rising.append(self.flagHandler(False, mask))
+		rising.append(self.ALU[mc >> 3 & 15])
+
+		falling = [
+			self.MEM_WRITE[mc >> 28 & 3],
+			self.DEST[mc >> 18 & 15],
+			self.COUNTER_POST[mc >> 15 & 7],
+		]
+
+		d = self.decodedWords[mc] = (tuple(h for h in rising if h), tuple(h for h in falling if h))
+
+		return d
+
+	def decodeMicrocode(self):
+
+		microcode = self.microcode
+		words = [self.decodeWord(mc) for mc in microcode]
+
+		sequences = self.sequences = []
+		timing = self.timing = []
+		for addr in range(MC_WORDS):
+			seq = []
+			fetch = False
+			a = addr
+			while True:
+				seq.append(words[a])
+				mc = microcode[a]
+				fetch |= bool(mc & MC_FETCH)
+				a += 1
+				if mc & MC_END or a & 7 == 0:						# ? end, or the end of the slot
+					break																	# --->
+
+			sequences.append(tuple(seq))
+			timing.append(len(seq) + (0 if fetch else 1))
+
+		condition = self.condition = []
+		empty = self.empty = []
+		branches = self.branches = []
+		steps = self.steps = []
+		for op in range(MC_WORDS >> 3):
+			mc = microcode[op << 3]
+			if mc & (MC_FLAG_SET | MC_FLAG_CLEAR):			# ? flag change, not a condition
+				condition.append(0)
+			else:
+				condition.append(mc >> 7 & 0x3f)
+			empty.append(mc == 0)
+
+			step = 1																	# fetch
+			branch = condition[op] != 0
+			for addr in range(op << 3, (op << 3) + len(sequences[op << 3])):
+				mc = microcode[addr]
+				branch |= mc >> 18 & 15 == 6							# bus -> pc
+				step += (0, 0, 0, 0, 0, 1, 2, 0)[mc >> 15 & 7]	# pc+1 pc+2
+			branches.append(branch)
+			steps.append(step)
+
+		return
+
+	#
+	#	Statements for the instruction from a microcode address, opcode fetch first
+	#	Returns (statements, microcode pointer after, cycles)
+	#
+	def sequenceBody(self, op, addr):
+
+		microcode = self.microcode
+		memRead = MEM_READ_IO_CODE if self.devices else MEM_READ_CODE
+		body = ["pc = pc + 1 & 0xffff", "bus = {}".format(op)]		# fetch
+
+		a = addr
+		while True:
+			mc = microcode[a]
+			a += 1
+			body.append("# ${:03x} ${:08x}".format(a -1, mc))
+
+			mask = mc >> 7 & 0x3f
+			alu = ALU_CODE[mc >> 3 & 15]
+			code = [
+				memRead[mc >> 26 & 3],										# rising
+				SRC_CODE[mc >> 22 & 15],
+				COUNTER_PRE_CODE[mc >> 15 & 7],
+				"flags |= {}".format(mask) if mc & MC_FLAG_SET and mask else None,
+				"flags &= {}".format(~mask) if mc & MC_FLAG_CLEAR and mask else None,
+			]
+			if alu:
+				code += [
+					"x = " + alu[0],
+					"alur = x & 0xffff",
+					"flags = flags & ~15 | alur >> 12 & 8 | (alur == 0) << 1 | {} | {}".format(alu[1], alu[2]),
+				]
+			code += MEM_WRITE_CODE[mc >> 28 & 3]				# falling
+			code += [
+				DST_CODE[mc >> 18 & 15],
+				COUNTER_POST_CODE[mc >> 15 & 7],
+			]
+			body += [c for c in code if c]
+
+			if mc & MC_END or a & 7 == 0:							# ? end, or the end of the slot
+				break																		# --->
+
+		return body, a, self.timing[addr]
+
+	#
+	#	Python source for the instruction from a microcode address
+	#
+	def compileSequence(self, op, addr):
+
+		body, mcp, cycles = self.sequenceBody(op, addr)
+
+		return functionText("op_{:02x}".format(op), body + ["mcp = {}".format(mcp), "cycles += {}".format(cycles)])
+
+	#	Globals for generated code
+	#
+	def codeGlobals(self):
+		return {"writeTraps": self.writeTraps, "writeTrap": self.writeTrap,
+			"ioPages": self.ioPages, "ioByte": self.ioByte, "ioWord": self.ioWord}
+
+	def compileMicrocode(self):
+
+		self.flushBlocks()
+		compiled = self.compiled = []
+		compiledText = self.compiledText = []
+		for op in range(MC_WORDS >> 3):
+			if self.empty[op]:
+				compiled.append(None)
+				compiledText.append(None)
+				continue																	# <-------
+
+			fns = []
+			texts = []
+			for addr in (op << 3, op << 3 | 4):					# flag clear, flag set variants
+				text = self.compileSequence(op, addr)
+				fns.append(compileFunction(text, "op_{:02x}".format(op), "<op ${:02x}>".format(op), self.codeGlobals()))
+				texts.append(text)
+
+			compiled.append(tuple(fns))
+			compiledText.append(tuple(texts))
+
+		return
+
+	#
+	#	A memory write to n bytes from an address with a trap set
+	#
+	def writeTrap(self, addr, n):
+
+		traps = self.writeTraps
+		for i in range(n):
+			a = addr + i & 0xffff
+			if traps[a] & TRAP_WATCH and self.watchHit is None:
+				self.watchHit = a
+			if traps[a] & TRAP_DEVICE:
+				d = self.ioMap[a]
+				d.write(a - d.base, self.ram[a])
+		self.invalidate(addr, n)
+
+		return
+
+	#
+	#	Drop every block holding an opcode in n bytes from an address
+	#
+	def invalidate(self, addr, n):
+
+		owners = self.owners
+		traps = self.writeTraps
+		for i in range(n):
+			a = addr + i & 0xffff
+			for b in owners.pop(a, ()):
+				self.dropBlock(b)
+			traps[a] &= ~TRAP_CODE
+
+		return
+
+	def dropBlock(self, b):
+
+		if not b.valid:
+			return																			# ------>
+
+		b.valid = False
+		if self.blocks.get(b.start) is b:
+			del self.blocks[b.start]
+
+		for a in b.ops:
+			held = self.owners.get(a)
+			if held is not None and b in held:
+				held.remove(b)
+			if not held:
+				self.owners.pop(a, None)
+				self.writeTraps[a] &= ~TRAP_CODE
+
+		return
+
+	#
+	#	Drop every block, eg. after ram or microcode is loaded
+	#
+	def flushBlocks(self):
+
+		for b in self.blocks.values():
+			b.valid = False
+		self.blocks.clear()
+		self.owners.clear()
+		self.writeTraps[:] = self.writeTraps.translate(TRAP_CLEAR_CODE)
+
+		return
+
+	#
+	#	Attach a device on its size addresses from its base, see devices.py
+	#
+	#	Claimed pages are marked in ioPages, reads on any other page stay on the plain ram
+	#	path, and claimed addresses TRAP_DEVICE in writeTraps, so writes land in ram as
+	#	usual then reach the device through writeTrap.  The first device rebuilds the
+	#	memory read handlers & compiled code with the page check, until then there is none.
+	#
+	def attach(self, device):
+
+		addrs = [device.base + i & 0xffff for i in range(device.size)]
+		if any(a in self.ioMap for a in addrs):
+			raise ValueError("device at ${:04x} overlaps another".format(device.base))
+
+		first = not self.devices
+		self.devices.append(device)
+		for a in addrs:
+			self.ioMap[a] = device
+			self.ioPages[a >> 8] = 1
+			self.writeTraps[a] |= TRAP_DEVICE
+		device.attach(self)
+
+		if first:
+			(self.MEM_READ, self.MEM_WRITE, self.SOURCE, self.DEST,
+				self.COUNTER_PRE, self.COUNTER_POST, self.ALU, self.flagHandler) = handlers(self)
+			self.decodedWords = {}
+			self.decodeMicrocode()
+			self.compileMicrocode()
+
+		return
+
+	#	Byte & word reads on a page with a device, unclaimed addresses from ram
+	#
+	def ioByte(self, addr):
+
+		d = self.ioMap.get(addr)
+		if d is None:
+			return self.ram[addr]												# ------>
+
+		return d.read(addr - d.base)
+
+	def ioWord(self, addr):
+		return self.ioByte(addr) | self.ioByte(addr + 1 & 0xffff) << 8
+
+	#
+	#	Translate the block at a PC, None if its opcode has no microcode
+	#
+	def translate(self, pc):
+
+		ram = self.ram
+		microcode = self.microcode
+		body = []
+		ops = []
+		cycles = 0
+		mcp = 0
+		a = pc
+		for i in range(BLOCK_MAX):
+			op = ram[a]
+			if self.empty[op] or a in ops:						# ? halts, or loops back into the block
+				break																		# --->
+			ops.append(a)
+
+			cond = self.condition[op]
+			if cond:																	# ? flag variants
+				body.append("cycles += {}".format(cycles))
+				for v, addr in (("if flags & {}:".format(cond), op << 3 | 4), ("else:", op << 3)):
+					b, m, c = self.sequenceBody(op, addr)
+					body.append(v)
+					body += ["	" + line for line in b + ["mcp = {}".format(m), "cycles += {}".format(c)]]
+				cycles = -1
+				break																		# --->
+
+			b, mcp, c = self.sequenceBody(op, op << 3)
+			body += b
+			cycles += c
+			if self.branches[op]:
+				break																		# --->
+			a = a + self.steps[op] & 0xffff
+
+			if any(microcode[x] >> 28 & 3 in (1, 2) for x in range(op << 3, mcp)):	# ? memory write
+				body += [																# over this block, stop before the next
+					"if not block.valid:",
+					"	mcp = {}".format(mcp),
+					"	cycles += {}".format(cycles),
+					"	return {}".format(len(ops)),				# instructions run
+				]
+
+		if not ops:
+			return None																	# ------>
+
+		if cycles >= 0:
+			body += ["mcp = {}".format(mcp), "cycles += {}".format(cycles)]
+
+		name = "block_{:04x}".format(pc)
+		text = functionText(name, body)
+		g = self.codeGlobals()
+		b = Block(compileFunction(text, name, "<block ${:04x}>".format(pc), g), pc, ops, text)
+		g["block"] = b
+
+		self.blocks[pc] = b
+		for a in ops:
+			self.owners.setdefault(a, []).append(b)
+			self.writeTraps[a] |= TRAP_CODE
+
+		return b
+
+	#
+	#	Load microcode from an .obj, srec or ihex, or a .bin of little endian words
+	#
+	def loadMicrocode(self, name):
+
+		if name.endswith(".bin"):
+			with open(name, "rb") as f:
+				b = f.read(MC_WORDS * 4)
+			self.opNames = {}
+		else:
+			image = loader.load(name, unit = 4)
+			b = image.flatten(0, MC_WORDS * 4)
+			self.opNames = {v: l[:-6] for l, v in image.symbols.items() if l.endswith(".instr")}
+
+		self.microcode[:] = array.array("I", bytes(b).ljust(MC_WORDS * 4, b"\0"))
+		if sys.byteorder == "big":
+			self.microcode.byteswap()
+		self.decodeMicrocode()
+		self.compileMicrocode()
+
+		return
+
+	#
+	#	Load a program into ram, returns its symbols
+	#
+	def loadProgram(self, name):
+
+		if name.endswith(".bin"):
+			with open(name, "rb") as f:
+				b = f.read(RAM_BYTES)
+			symbols = {}
+		else:
+			image = loader.load(name)
+			b = image.flatten(0, RAM_BYTES)
+			symbols = image.symbols
+
+		self.ram[:] = bytes(b).ljust(RAM_BYTES, b"\0")
+		self.flushBlocks()
+
+		return symbols
+
+	#
+	#	Return the instruction at the PC
+	#
+	def fetch(self):
+
+		reg = self.reg
+		reg.bus = self.ram[reg.pc]
+		reg.pc = reg.pc + 1 & 0xffff
+
+		return
+
+	#
+	#	Generate the MCPC from the opcode on the bus
+	#
+	def decode(self):
+
+		reg = self.reg
+		reg.mcp = reg.bus << 3												# 3 bits for microcode line
+
+		if self.condition[reg.bus] & reg.flags:				# ? selected flag set
+			reg.mcp |= 4																# => set in the counter
+
+		return
+
+	#
+	#	Sequence through microcode from MCPC, the end word included
+	#	write to the bus on rising edge
+	#	read from the bus on falling edge
+	#
+	def execute(self):
+
+		reg = self.reg
+		mcp = reg.mcp
+		seq = self.sequences[mcp]
+		for rising, falling in seq:
+			for h in rising:														# clock rising edge
+				h()
+			for h in falling:														# clock falling edge
+				h()
+
+		reg.cycles += self.timing[mcp]
+		reg.mcp = mcp + len(seq)
+
+		return
+
+	#
+	#	One instruction, False once halted
+	#
+	def step(self):
+
+		reg = self.reg
+		if reg.halted or self.empty[self.ram[reg.pc]]:
+			reg.halted = True
+			return False																# ------>
+
+		self.fetch()
+		self.decode()
+		self.execute()
+
+		return True
+
+	#
+	#	Run until halted, out of cycles or stopped, returns instructions executed
+	#		mode			MODE_BLOCKS, MODE_COMPILED or MODE_INTERPRET
+	#		untilPC		stop before the instruction at this PC
+	#
+	#	Sets stopped to why, STOP_..., & stopAddr to the PC or address for a stop.
+	#	With a profile, trace, breakpoints, watchpoints or an until PC the run goes
+	#	instruction by instruction through runChecked, else the mode's loop is unchecked.
+	#	Devices are flushed when the run ends.
+	#
+	def run(self, maxCycles, mode = MODE_BLOCKS, untilPC = None):
+
+		if mode not in MODES:
+			raise ValueError("unknown mode {}".format(mode))
+
+		if (self.profile is not None or self.trace is not None or untilPC is not None
+				or self.breakpoints or self.watchpoints):
+			n = self.runChecked(maxCycles, mode, untilPC)
+		else:
+			if mode == MODE_INTERPRET:
+				n = self.runInterpret(maxCycles)
+			elif mode == MODE_COMPILED:
+				n = self.runCompiled(maxCycles)
+			else:
+				n = self.runBlocks(maxCycles)
+
+			self.stopped = STOP_HALTED if self.reg.halted else STOP_CYCLES
+			self.stopAddr = None
+
+		for d in self.devices:
+			d.flush()
+
+		return n
+
+	def runInterpret(self, maxCycles):
+
+		reg = self.reg
+		step = self.step
+		n = 0
+		while reg.cycles < maxCycles and step():
+			n += 1
+
+		return n
+
+	def runCompiled(self, maxCycles):
+
+		r = self.reg
+		ram = self.ram
+		fns = self.compiled
+		condition = self.condition
+		n = 0
+		while r.cycles < maxCycles:
+			op = ram[r.pc]
+			f = fns[op]
+			if f is None:															# ? no microcode
+				r.halted = True
+				break																		# --->
+
+			f[1 if condition[op] & r.flags else 0](r, ram)
+			n += 1
+
+		return n
+
+	#
+	#	Blocks chain to the next through their exits, the block index only on a miss
+	#
+	def runBlocks(self, maxCycles):
+
+		r = self.reg
+		ram = self.ram
+		blocks = self.blocks
+		translate = self.translate
+		n = 0
+		b = None
+		while r.cycles < maxCycles:
+			pc = r.pc
+			nb = b.exits.get(pc) if b is not None else None
+			if nb is None or not nb.valid:
+				nb = blocks.get(pc) or translate(pc)
+				if nb is None:														# ? no microcode
+					r.halted = True
+					break																	# --->
+				if b is not None:
+					b.exits[pc] = nb
+
+			b = nb
+			k = b.fn(r, ram)															# ? returned early, instructions run
+			n += b.count if k is None else k
+
+		return n
+
+	#
+	#	Instruction by instruction, for the profile, trace, breakpoints & watchpoints
+	#	Stops before an instruction at a breakpoint or the until PC, except the first,
+	#	and after an instruction writing a watched address.
+	#
+	def runChecked(self, maxCycles, mode, untilPC = None):
+
+		p = self.profile
+		if p is not None:
+			ops, opCycles, starts, pcs, pcCycles = p.ops, p.opCycles, p.starts, p.pcs, p.pcCycles
+		trace = self.trace
+		breakMap = self.breakMap
+		r = self.reg
+		ram = self.ram
+		fns = self.compiled
+		condition = self.condition
+		empty = self.empty
+		interpret = mode == MODE_INTERPRET
+
+		self.watchHit = None
+		self.stopAddr = None
+		stopped = STOP_CYCLES
+		n = 0
+		while r.cycles < maxCycles:
+			pc = r.pc
+			if n and (breakMap[pc] or pc == untilPC):
+				stopped = STOP_UNTIL if pc == untilPC else STOP_BREAK
+				self.stopAddr = pc
+				break																		# --->
+
+			op = ram[pc]
+			if empty[op]:															# ? no microcode
+				r.halted = True
+				stopped = STOP_HALTED
+				break																		# --->
+
+			if trace is not None:
+				trace.record(pc, op, r)
+
+			c = r.cycles
+			v = 1 if condition[op] & r.flags else 0
+			if interpret:
+				self.step()
+			else:
+				fns[op][v](r, ram)
+			n += 1
+
+			if p is not None:
+				c = r.cycles - c
+				ops[op] += 1
+				opCycles[op] += c
+				starts[op << 3 | v << 2] += 1
+				pcs[pc] += 1
+				pcCycles[pc] += c
+
+			if self.watchHit is not None:
+				stopped = STOP_WATCH
+				self.stopAddr = self.watchHit
+				self.watchHit = None
+				break																		# --->
+
+		self.stopped = stopped
+
+		return n
+
+	#
+	#	Breakpoints stop a run before the instruction at a PC
+	#
+	def setBreakpoint(self, pc):
+
+		self.breakpoints.add(pc & 0xffff)
+		self.breakMap[pc & 0xffff] = 1
+
+		return
+
+	def clearBreakpoint(self, pc):
+
+		self.breakpoints.discard(pc & 0xffff)
+		self.breakMap[pc & 0xffff] = 0
+
+		return
+
+	#
+	#	Watchpoints stop a run after an instruction writing n bytes from an address
+	#
+	def setWatchpoint(self, addr, n = 1):
+
+		for i in range(n):
+			self.watchpoints.add(addr + i & 0xffff)
+			self.writeTraps[addr + i & 0xffff] |= TRAP_WATCH
+
+		return
+
+	def clearWatchpoint(self, addr, n = 1):
+
+		for i in range(n):
+			self.watchpoints.discard(addr + i & 0xffff)
+			self.writeTraps[addr + i & 0xffff] &= ~TRAP_WATCH
+
+		return
+
+	def microcodeBytes(self):
+
+		if sys.byteorder == "big":
+			words = array.array("I", self.microcode)
+			words.byteswap()
+			return words.tobytes()												# ------>
+
+		return self.microcode.tobytes()
+
+	#
+	#	Snapshot the machine, sharing unchanged pages & microcode with a parent snapshot
+	#
+	def snapshot(self, parent = None):
+
+		r = self.reg
+		ram = self.ram
+		pages = []
+		for i, p in enumerate(range(0, RAM_BYTES, SNAP_PAGE)):
+			page = ram[p:p + SNAP_PAGE]
+			if parent is not None and parent.pages[i] == page:
+				pages.append(parent.pages[i])						# shared
+			else:
+				pages.append(bytes(page))
+
+		mc = self.microcodeBytes()
+		if parent is not None and parent.microcode == mc:
+			mc = parent.microcode
+
+		return Snapshot(tuple(getattr(r, n) for n in SNAP_REGISTERS), r.cycles, r.halted, mc, tuple(pages))
+
+	#
+	#	Put the machine back as it was at a snapshot
+	#
+	def restore(self, snap):
 
-	if mc & mc_fetch:
-		rAddr = rPC												# models a direct PC to Addr path
-		rPC += 1
+		if self.microcodeBytes() != snap.microcode:
+			self.microcode[:] = array.array("I", bytes(snap.microcode))
+			if sys.byteorder == "big":
+				self.microcode.byteswap()
+			self.decodeMicrocode()
+			self.compileMicrocode()
 
-	if mc & mc_word_w:									# write memory
-		ram[rAddr]		= BUS & 0xff
-		ram[rAddr+1]	= BUS >> 8
-	if mc & mc_byte_w:
-		ram[rAddr] 		= BUS & 0xff
-	if mc & mc_addr_w:
-		rAddr = BUS
+		ram = self.ram
+		for i, p in enumerate(range(0, RAM_BYTES, SNAP_PAGE)):
+			page = snap.pages[i]
+			if ram[p:p + SNAP_PAGE] != page:							# ? written since
+				ram[p:p + SNAP_PAGE] = page
+				if any(self.writeTraps[p:p + SNAP_PAGE]):
+					self.invalidate(p, SNAP_PAGE)
 
-	if mc & mc_a_w:	rA = BUS
-	if mc & mc_b_w:	rB = BUS
-	if mc & mc_x_w:	rX = BUS
-	if mc & mc_y_w:	rY = BUS
+		r = self.reg
+		for n, v in zip(SNAP_REGISTERS, snap.registers):
+			setattr(r, n, v)
+		r.cycles = snap.cycles
+		r.halted = snap.halted
 
-	if mc & mc_t_w:	rT = BUS
-	if mc & mc_n_w:	rN = BUS
-	if mc & mc_r_w:	rR = BUS
-	if mc & mc_o_w:	rO = BUS
+		return
+
+	#
+	#	Register summary
+	#
+	def registers(self):
+
+		r = self.reg
+		return "pc ${:04x} a ${:04x} b ${:04x} t ${:04x} n ${:04x} r ${:04x} o ${:04x} " \
+			"sp ${:04x} rsp ${:04x} w ${:04x} flags ${:02x}".format(
+			r.pc, r.a, r.b, r.t, r.n, r.r, r.o, r.sp, r.rsp, r.w, r.flags)
+
+
+#
+#	Snapshots of the whole machine, registers, ram & microcode
+#
+#	In memory ram is held as a tuple of immutable pages, a snapshot taken from a parent
+#	shares every page that hasn't changed since, so forks cost only the pages they write.
+#	Restoring copies back only the pages that differ from ram, dropping just the blocks
+#	translated from those, and reloads microcode only if it differs.
+#
+#	Files are a fixed layout, so one can be memory mapped & restored without a copy
+#		header			magic, version, page size, registers, cycles, halted, to 256 bytes
+#		microcode		2K little endian 32 bit words
+#		ram					64K
+#
+SNAP_MAGIC = b"CPUSNAP\0"
+SNAP_VERSION = 1
+SNAP_PAGE = 256
+SNAP_REGISTERS = ("a", "b", "t", "n", "r", "o", "sp", "rsp", "pc", "w", "flags", "alu1", "alu2", "alur",
+	"addr", "mcp", "bus")
 
-	if mc & mc_sp_w:	rSP = BUS
-	if mc & mc_rsp_w:	rRSP = BUS
+SNAP_HEAD = struct.Struct("<8sHH{}HQ?".format(len(SNAP_REGISTERS)))
+SNAP_MICROCODE = 256																# file offsets
+SNAP_RAM = SNAP_MICROCODE + MC_WORDS * 4
+SNAP_BYTES = SNAP_RAM + RAM_BYTES
 
-	if mc & mc_pc_w:	rPC = BUS
-	if mc & mc_w_w:		rW = BUS
+class Snapshot:
 
-	if mc & mc_f_w:		rFlags = BUS
+	__slots__ = ("registers", "cycles", "halted", "microcode", "pages")
 
-	if mc & mc_alu1_w:	rALU1 = BUS
-	if mc & mc_alu2_w:	rALU2 = BUS
-	if mc & mc_alur_w:	rALUR = BUS
+	def __init__(self, registers, cycles, halted, microcode, pages):
+		self.registers = registers										# values in SNAP_REGISTERS order
+		self.cycles = cycles
+		self.halted = halted
+		self.microcode = microcode										# little endian bytes
+		self.pages = pages														# ram, SNAP_PAGE bytes each
 
-	if mc & mc_sp_plus2:								# counters post increment
-		rSP += 2
-	if mc & mc_rsp_plus2:
-		rRSP += 2
-	if mc & mc_pc_plus1:
-		rPC += 1
-	if mc & mc_pc_plus2:
-		rPC += 2
+
+#
+#	Write a snapshot file, eg. saveSnapshot(name, cpu.snapshot())
+#
+def saveSnapshot(name, snap):
+
+	head = SNAP_HEAD.pack(SNAP_MAGIC, SNAP_VERSION, SNAP_PAGE, *snap.registers, snap.cycles, snap.halted)
+	with open(name, "wb") as f:
+		f.write(head.ljust(SNAP_MICROCODE, b"\0"))
+		f.write(snap.microcode)
+		f.writelines(snap.pages)
 
 	return
 
 
 #
+#	Read a snapshot file, its microcode & pages are views of the memory mapped file
+#	Raises ValueError if it isn't one
 #
+def loadSnapshot(name):
+
+	with open(name, "rb") as f:
+		try:
+			m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		except ValueError:															# empty
+			m = b""
+
+	if len(m) != SNAP_BYTES:
+		raise ValueError("{} is not a snapshot, {} bytes".format(name, len(m)))
+
+	head = SNAP_HEAD.unpack_from(m)
+	if head[0] != SNAP_MAGIC or head[1] != SNAP_VERSION or head[2] != SNAP_PAGE:
+		raise ValueError("{} is not a version {} snapshot".format(name, SNAP_VERSION))
+
+	v = memoryview(m)
+	return Snapshot(head[3:-2], head[-2], head[-1], v[SNAP_MICROCODE:SNAP_RAM],
+		tuple(v[p:p + SNAP_PAGE] for p in range(SNAP_RAM, SNAP_BYTES, SNAP_PAGE)))
+
+
 #
-init()
-fetch()
-decode()
-execute()
+#	Start address from a label, "start" is 0 if there's no such label, else $hex or a number
+#
+def startAddress(pc, symbols):
+
+	if pc in symbols:
+		return symbols[pc] & 0xffff													# ------>
+	if pc == "start":
+		return 0																			# ------>
 
+	return int(pc.replace("$", "0x"), 0) & 0xffff
 
+
+#
+#	sim.py program [--microcode name] [--pc addr] [--cycles n] [--mode blocks|compiled|interpret]
+#		[--restore snapshot] [--save snapshot] [--profile file]
+#		[--until pc] [--break pc]... [--watch addr]... [--trace n] [--io] [--input file] [--disk file]
+#
+def main(argv = None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description = "Microcode level simulator")
+	parser.add_argument("program", nargs = "?", help = "program .obj or 64K .bin image")
+	parser.add_argument("--microcode", default = "microcode.obj", help = "microcode .obj or .bin")
+	parser.add_argument("--pc", default = "start", help = "start address or label, $hex allowed")
+	parser.add_argument("--cycles", type = int, default = 1000000, help = "cycle budget")
+	parser.add_argument("--mode", choices = MODES, default = MODE_BLOCKS,
+											help = "translated blocks, compiled instructions or the microcode interpreter, the reference")
+	parser.add_argument("--restore", metavar = "FILE", help = "start from a snapshot instead of a program")
+	parser.add_argument("--save", metavar = "FILE", help = "write a snapshot when the run ends")
+	parser.add_argument("--profile", metavar = "FILE", help = "profile the run, print a report & write the raw counts as JSON")
+	parser.add_argument("--until", metavar = "PC", help = "stop before the instruction at an address or label")
+	parser.add_argument("--break", dest = "breaks", metavar = "PC", action = "append", default = [],
+											help = "breakpoint at an address or label, repeatable")
+	parser.add_argument("--watch", metavar = "ADDR", action = "append", default = [],
+											help = "stop after a write to an address or label, repeatable")
+	parser.add_argument("--trace", metavar = "N", type = int, default = 0, help = "print the last N instructions run")
+	parser.add_argument("--io", action = "store_true", help = "attach the console & timer, see devices.py")
+	parser.add_argument("--input", metavar = "FILE", help = "console input file, - for stdin, implies --io")
+	parser.add_argument("--disk", metavar = "FILE", help = "block device image file, created if missing, implies --io")
+	args = parser.parse_args(argv)
+
+	if args.program is None and args.restore is None:
+		parser.error("a program or --restore snapshot is required")
+
+	cpu = CPU()
+	symbols = {}
+	if args.restore:
+		cpu.restore(loadSnapshot(args.restore))
+	else:
+		cpu.loadMicrocode(args.microcode)
+		symbols = cpu.loadProgram(args.program)
+		cpu.reset(startAddress(args.pc, symbols))
+
+	if args.profile:
+		cpu.profile = Profile()
+	if args.trace:
+		cpu.trace = Trace(args.trace)
+	for pc in args.breaks:
+		cpu.setBreakpoint(startAddress(pc, symbols))
+	for addr in args.watch:
+		cpu.setWatchpoint(startAddress(addr, symbols))
+	until = None if args.until is None else startAddress(args.until, symbols)
+
+	input = None
+	if args.io or args.input or args.disk:
+		import devices
+		if args.input:
+			input = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+		devices.standard(cpu, input = input, disk = args.disk)
+
+	reg = cpu.reg
+	c = reg.cycles
+	t = time.perf_counter()
+	n = cpu.run(c + args.cycles, args.mode, until)
+	t = time.perf_counter() - t
+
+	for d in cpu.devices:
+		d.close()
+	if input is not None and input is not sys.stdin.buffer:
+		input.close()
+
+	if args.save:
+		saveSnapshot(args.save, cpu.snapshot())
+
+	if args.trace:
+		print(cpu.trace.text(cpu.opNames), end = "")
+	print(cpu.registers())
+	print("{} instructions, {} cycles, {}{}, {:.0f} cycles/sec".format(n, reg.cycles, cpu.stopped,
+		"" if cpu.stopAddr is None else " at ${:04x}".format(cpu.stopAddr), (reg.cycles - c) / t if t else 0))
+
+	if args.profile:
+		import json
+		print()
+		print(cpu.profile.report(cpu, symbols), end = "")
+		with open(args.profile, "w") as f:
+			json.dump(cpu.profile.data(cpu, symbols), f)
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
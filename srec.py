@@ -32,44 +32,193 @@ def srec(addr, bytes, type = 1):
 	b = "".join("{:02x}".format(x) for x in bytes)
 	c = 0xff - (n + ac + sum(bytes) & 0xff)
 
-	rec = "S{}{:02x}{}{}{:02x}".format(type, n, a, b, c)
+	rec = "S{:X}{:02x}{}{}{:02x}".format(type, n, a, b, c)
 
 	return rec
 
 
 #
-#	Return S4/6 non standard address/label record
+#	Generator of the records for a whole image, bytes, bytearray or memoryview at base
 #
-def srecL(addr, label):
+#	S1, S2 or S3 data records as the last address needs, each recordBytes long or the most
+#	the record type holds, hex encoded in bulk.  unit is bytes per address, eg. 4 for 32 bit
+#	microcode words, records hold whole units.  header adds an S0 record first, end adds
+#	the S9, S8 or S7 terminator with the start address.
+#
+def encode(data, base = 0, recordBytes = 0, unit = 1, start = 0, header = None, end = True):
+
+	data = memoryview(data)
+	last = base + max(0, len(data) -1) // unit
+	a = 2 if last <= 0xffff else 3 if last <= 0xffffff else 4		# address bytes
+	n = (recordBytes or 0xff - a - 1) // unit * unit
+
+	if not 0 < n <= 0xff - a - 1:
+		raise ValueError("{} bytes per record, 1 to {}".format(recordBytes, 0xff - a - 1))
+
+	if header is not None:
+		yield encodeRecord(0, 0, 2, header.encode("latin-1"))
+
+	type = a - 1																		# S1 S2 S3
+	for i in range(0, len(data), n):
+		yield encodeRecord(type, base + i // unit, a, data[i:i +n])
+
+	if end:
+		yield encodeRecord(10 - type, start, a, b"")		# S9 S8 S7
+
+
+#
+#	Return one record from its type, address & data, hex encoded in bulk
+#
+def encodeRecord(type, addr, addrBytes, data):
+
+	head = bytes((len(data) + addrBytes + 1,)) + addr.to_bytes(addrBytes, "big")
+
+	return "S{:X}{}{}{:02x}".format(type, head.hex(), data.hex(), 0xff - (sum(head) + sum(data) & 0xff))
+
+
+#
+#	Non standard record types
+#		S4/S6		label, address is its value
+#		SA			relocatable label, address is its module relative value
+#		SB			relocation, address of a field to add the module base to, one byte field width
+#		SC			import, address of a field to add a symbol to, field width byte then the symbol name
+#	SA/SB/SC have 16 bit addresses only
+#
+REC_LABEL				= 4
+REC_RELOC_LABEL	= 0xa
+REC_RELOC				= 0xb
+REC_IMPORT			= 0xc
+
+LABEL_TYPES = (4, 6, 0xa)
+
+
+#
+#	Return S4/6/A non standard address/label record
+#
+def srecL(addr, label, type = REC_LABEL):
 
 	bytes = [ord(x) for x in list(label)]					# string to list of character byte values
-	rec = srec(addr, bytes, 4)
+	if type != REC_LABEL and addr > 0xffff: return ""
+	rec = srec(addr, bytes, type)
 
 	return rec
 
 
+#
+#	Return SB relocation & SC import records for a field of width bytes
+#
+def srecR(addr, width):
+
+	if addr > 0xffff: return ""
+	return srec(addr, [width], REC_RELOC)
+
+
+def srecI(addr, width, label):
+
+	if addr > 0xffff: return ""
+	return srec(addr, [width] + [ord(x) for x in label], REC_IMPORT)
+
+
+#
+#	Address bytes by record type, S2/S8 24 bit, S3/S7 & label S6 32 bit, others 16 bit
+#
+ADDR_BYTES = {2: 3, 3: 4, 6: 4, 7: 4, 8: 3}
+
+
+#
+#	Return a record's type, address and data bytes, checking its length & checksum
+#	Raises ValueError on a corrupt record
+#
+def decodeRecord(line):
+
+	line = line.strip()
+	if line[:1] != "S" or len(line) < 4:
+		raise ValueError("not an SREC record")
+
+	try:
+		type = int(line[1], 16)
+		raw = bytes.fromhex(line[2:])								# count, address, data, checksum
+	except ValueError:
+		raise ValueError("bad hex digits") from None
+
+	if raw[0] != len(raw) -1:
+		raise ValueError("length {} but {} bytes".format(raw[0], len(raw) -1))
+	if sum(raw) & 0xff != 0xff:										# ones complement of the sum
+		raise ValueError("bad checksum")
+
+	a = ADDR_BYTES.get(type, 2) +1
+	if len(raw) < a +1:
+		raise ValueError("record too short")
+
+	return type, int.from_bytes(raw[1:a], "big"), memoryview(raw)[a:-1]
+
+
+#
+#	Return a record's type, address and list of bytes
+#
+def record(line):
+
+	type, addr, data = decodeRecord(line)
+
+	return type, addr, list(data)
+
+
 #
 #	Return an address and list of bytes or label from an srec
 #	addr, [byte,...]
 #
 def parse(line):
 
-	type = int(line[1:2], 16)
-	if type == 1 or type == 4:										# ? 16 bit address
-		num = (int(line[2:4], 16) -3) *2
-		addr = int(line[4:8], 16)
-		b1 = 8																			# first data byte
-
-	elif type == 3 or type == 6:									# ? 32 bit address
-		num = (int(line[2:4], 16) -5) *2
-		addr = int(line[4:12], 16)
-		b1 = 12																			# first date byte
+	type, addr, bytes = record(line)
 
-	bytes = []
-	for i in range(b1, b1 + num, 2):							# hex char pairs
-		bytes.append(int(line[i:i +2], 16))					# to decimal bytes
-
-	if type == 4 or type == 6:										# type 4 from srecL, return as a label name
+	if type in LABEL_TYPES:												# type 4 from srecL, return as a label name
 		bytes = "".join(chr(x) for x in bytes)
 
 	return addr, bytes
+
+
+#
+#	Generator of (type, address, data) over the lines of a file of any size
+#	data is a memoryview, blank lines are skipped
+#	Raises ValueError with the line number on the first corrupt record
+#
+def records(lines):
+
+	fromhex = bytes.fromhex
+	addrBytes = ADDR_BYTES
+	n = 0
+	for line in lines:
+		n += 1
+
+		#	Fast path, a well formed record, fromhex skips the line end
+		#
+		if line[:1] == "S":
+			try:
+				type = int(line[1], 16)
+				raw = fromhex(line[2:])
+			except (ValueError, IndexError):
+				type, raw = 0, b""
+			a = addrBytes.get(type, 2) +1
+			if len(raw) > a and raw[0] == len(raw) -1 and sum(raw) & 0xff == 0xff:
+				yield type, int.from_bytes(raw[1:a], "big"), memoryview(raw)[a:-1]
+				continue																	# <-------
+
+		if line.isspace() or not line:
+			continue																		# <-------
+		try:																					# slow path, says what's wrong
+			yield decodeRecord(line)
+		except ValueError as e:
+			raise ValueError("line {}: {}".format(n, e)) from None
+
+
+#
+#	Generator of (address, data) for data records & (address, label) for label records
+#	Header, count, start address, relocation & import records are skipped
+#
+def decode(lines):
+
+	for type, addr, data in records(lines):
+		if 1 <= type <= 3:
+			yield addr, data
+		elif type in LABEL_TYPES:
+			yield addr, str(data, "latin-1")
@@ -0,0 +1,49 @@
+"""
+
+Assembler tests, run with pytest
+
+"""
+
+import io
+import os
+import re
+import shutil
+
+import asm
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LISTED = re.compile(r"^\s*\d+ [0-9a-f]{4} ")						# numbered listing lines
+
+
+#
+#	Assemble test.asm in a scratch directory, its listing lines & object text
+#
+def assembleTest(tmp_path, monkeypatch, passes):
+
+	for name in ("test.asm", "microcode.obj"):
+		shutil.copy(os.path.join(HERE, name), tmp_path)
+	monkeypatch.chdir(tmp_path)
+	asm.isaTables.clear()
+
+	out = io.StringIO()
+	a = asm.Assembler(out, passes)
+	a.assembleFile("test.asm")
+	assert a.errors == 0
+
+	lines = [l for l in out.getvalue().splitlines() if LISTED.match(l)]
+	with open("test.obj") as f:
+		return lines, f.read()
+
+
+#
+#	One pass patches forward references into the listing as well as the object
+#
+def testOnePassListing(tmp_path, monkeypatch):
+
+	one, oneObj = assembleTest(tmp_path, monkeypatch, 1)
+	two, twoObj = assembleTest(tmp_path, monkeypatch, 2)
+
+	assert one
+	assert one == two
+	assert oneObj == twoObj